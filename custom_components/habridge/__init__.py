@@ -1,6 +1,6 @@
 from __future__ import annotations
-from homeassistant.core import HomeAssistant, callback
-from homeassistant.const import EVENT_HOMEASSISTANT_STARTED
+from homeassistant.core import CoreState, HomeAssistant, callback
+from homeassistant.const import EVENT_HOMEASSISTANT_STARTED, EVENT_HOMEASSISTANT_STOP
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.helpers import entity_registry as er
 from homeassistant.helpers.storage import Store
@@ -16,6 +16,9 @@ from .const import (
     CONF_EXPOSE_DOMAINS,
     STORAGE_SETTINGS,
 )
+from .diagnostics import BlockingWatchdog
+from .memory import MemoryGovernor, trim_oldest
+from .persistence import DelayedSaves
 from .token_manager import TokenManager
 from .device_manager import DeviceManager
 from .http import (
@@ -26,11 +29,16 @@ from .http import (
     AdminPageView,
     DevicesView,
     LogsView,
+    TracesView,
+    SlowLogView,
+    ProfileView,
     SyncPreviewView,
     SettingsView,
     TriggerSyncView,
     AliasesView,
     StatusView,
+    MetricsView,
+    MemoryView,
 )
 import secrets
 import logging
@@ -47,8 +55,9 @@ async def _async_setup_internal(hass: HomeAssistant, *, client_id: str, client_s
 
     token_store = Store(hass, 1, STORAGE_TOKENS)
     device_store = Store(hass, 1, STORAGE_DEVICES)
-
-    token_mgr = TokenManager(hass, token_store, client_secret)
+    # Counted Store.async_delay_save for every habridge_* store (status / metrics)
+    saves = DelayedSaves()
+    token_mgr = TokenManager(hass, token_store, client_secret, saves)
     await token_mgr.async_load()
     # Migration: if user used older default (switch/light) and did not explicitly configure, extend with new defaults.
     if expose_domains:
@@ -57,9 +66,17 @@ async def _async_setup_internal(hass: HomeAssistant, *, client_id: str, client_s
         from .const import DEFAULT_EXPOSE  # local import to avoid circular at top
         if base_set.issubset(set(DEFAULT_EXPOSE)) and ("climate" not in base_set or "sensor" not in base_set):
             expose_domains = list(dict.fromkeys([*base_set, *DEFAULT_EXPOSE]))
-    device_mgr = DeviceManager(hass, device_store, expose_domains)
+    device_mgr = DeviceManager(hass, device_store, expose_domains, saves)
     await device_mgr.async_load()
     await device_mgr.auto_select_if_empty()
+    # Until HA has started, SYNC is answered from the persisted snapshot (warm start)
+    if hass.state is CoreState.running:
+        device_mgr.go_live()
+    else:
+        @callback
+        def _go_live(_event):
+            device_mgr.go_live()
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STARTED, _go_live)
 
     # Settings store (e.g. feature toggles). Keep simple dict. Currently: roomhint_enabled
     settings_store = Store(hass, 1, STORAGE_SETTINGS)
@@ -74,7 +91,7 @@ async def _async_setup_internal(hass: HomeAssistant, *, client_id: str, client_s
         settings['client_id'] = client_id
     if 'client_secret' not in settings:
         settings['client_secret'] = client_secret
-    await settings_store.async_save(settings)
+    saves.schedule("settings", settings_store, lambda: settings)
 
     hass.data[DOMAIN] = {
         "token_mgr": token_mgr,
@@ -83,6 +100,7 @@ async def _async_setup_internal(hass: HomeAssistant, *, client_id: str, client_s
         "client_secret": client_secret,
         "settings_store": settings_store,
         "settings": settings,
+        "saves": saves,
     }
 
     # Alias store
@@ -93,12 +111,30 @@ async def _async_setup_internal(hass: HomeAssistant, *, client_id: str, client_s
     hass.data[DOMAIN]["alias_store"] = alias_store
     hass.data[DOMAIN]["aliases"] = aliases
 
+    # Optional: attribute event loop stalls to call sites (settings blocking_*)
+    watchdog = BlockingWatchdog(hass)
+    hass.data[DOMAIN]["watchdog"] = watchdog
+    watchdog.configure(
+        bool(settings.get('blocking_watchdog')),
+        settings.get('blocking_threshold_ms'),
+        settings.get('blocking_interval_ms'),
+    )
+
+    @callback
+    def _stop_background(_event):
+        watchdog.stop()
+        memory = hass.data[DOMAIN].get("memory")
+        if memory is not None:
+            memory.stop()
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _stop_background)
+
     oauth_view = OAuthView(hass, token_mgr)
     token_view = TokenView(hass, token_mgr)
     smart_view = SmartHomeView(hass, token_mgr, device_mgr, client_secret)
     hass.http.register_view(oauth_view)
     hass.http.register_view(token_view)
     hass.http.register_view(smart_view)
+    hass.data[DOMAIN]["smart_view"] = smart_view
     admin_token = secrets.token_urlsafe(16)
     hass.data[DOMAIN]["admin_token"] = admin_token
 
@@ -106,11 +142,40 @@ async def _async_setup_internal(hass: HomeAssistant, *, client_id: str, client_s
     hass.http.register_view(AdminPageView(admin_token))
     hass.http.register_view(DevicesView(hass, device_mgr, admin_token, smart_view))
     hass.http.register_view(LogsView(smart_view, admin_token))
+    hass.http.register_view(TracesView(smart_view, admin_token))
+    hass.http.register_view(SlowLogView(smart_view, admin_token))
+    hass.http.register_view(ProfileView(hass, admin_token))
     hass.http.register_view(SyncPreviewView(device_mgr, admin_token))
     hass.http.register_view(SettingsView(hass, admin_token, smart_view))
     hass.http.register_view(TriggerSyncView(device_mgr, admin_token, smart_view))
     hass.http.register_view(AliasesView(hass, admin_token, smart_view))
     hass.http.register_view(StatusView(hass, admin_token, device_mgr))
+    hass.http.register_view(MetricsView(hass, device_mgr))
+    hass.http.register_view(MemoryView(hass, admin_token))
+
+    # Memory accounting (/habridge/memory) and budget (settings memory_budget_mb).
+    # Evictable structures get a priority: lowest is the least valuable and goes first.
+    memory = MemoryGovernor()
+    memory.register("logBuffer", lambda: smart_view._log_buf, evict=lambda f: trim_oldest(smart_view._log_buf, f), priority=10)
+    memory.register("traces", lambda: smart_view._tracer._traces, evict=lambda f: trim_oldest(smart_view._tracer._traces, f), priority=20)
+    memory.register("slowLog", lambda: smart_view._slow._entries, evict=smart_view._slow.trim, priority=30)
+    memory.register("authCodes", lambda: token_mgr._data.get("auth_codes"), evict=lambda _f: token_mgr.prune_auth_codes(), priority=35)
+    memory.register("execDeviceTimings", lambda: device_mgr._exec_device_timings, evict=device_mgr.trim_exec_timings, priority=40)
+    memory.register("blockingSites", lambda: watchdog._sites, evict=lambda _f: watchdog.reset(), priority=50)
+    memory.register("syncPayload", lambda: device_mgr._sync_encoded[1] if device_mgr._sync_encoded else None, evict=device_mgr.drop_sync_bytes, priority=55)
+    memory.register("syncCache", lambda: device_mgr._sync_cache, evict=device_mgr.drop_sync_cache, priority=60)
+    memory.register("queryTable", lambda: device_mgr._query_table)
+    memory.register("selections", lambda: device_mgr._selections)
+    memory.register("idmap", lambda: (device_mgr._stable_to_entity, device_mgr._entity_to_stable))
+    memory.register("snapshot", lambda: (device_mgr._snapshot_devices, device_mgr._snapshot_catalog))
+    memory.register("latencyWindows", lambda: device_mgr._latency)
+    memory.register("replayCache", lambda: smart_view._replay._entries)
+    memory.register("aliases", lambda: hass.data[DOMAIN]["aliases"])
+    memory.register("refreshTokens", lambda: token_mgr._data.get("refresh_tokens"))
+    memory.take_baseline()
+    memory.configure(settings.get('memory_budget_mb'))
+    memory.start(hass)
+    hass.data[DOMAIN]["memory"] = memory
 
     async def _register_panel(*_):
         if hass.data.get(PANEL_ID):
@@ -183,6 +248,13 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     return True
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
+    stored = hass.data.get(DOMAIN) or {}
+    watchdog = stored.get("watchdog")
+    if watchdog is not None:
+        watchdog.stop()
+    memory = stored.get("memory")
+    if memory is not None:
+        memory.stop()
     return True
 
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry):
@@ -4,6 +4,8 @@ STORAGE_DEVICES = "habridge_devices"
 STORAGE_IDMAP = "habridge_idmap"
 STORAGE_SETTINGS = "habridge_settings"
 STORAGE_ALIASES = "habridge_aliases"
+STORAGE_SNAPSHOT = "habridge_snapshot"
+STORE_SAVE_DELAY = 2.0  # seconds; Store.async_delay_save coalesces bursts of edits
 CONF_CLIENT_ID = "client_id"
 CONF_CLIENT_SECRET = "client_secret"
 CONF_ADMIN_API_KEY = "admin_api_key"
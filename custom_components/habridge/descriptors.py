@@ -0,0 +1,125 @@
+from __future__ import annotations
+import sys
+
+
+class SyncDevice:
+    """One SYNC device, kept compact in the SYNC cache.
+
+    Repeated values are shared between devices: ``traits`` is an interned tuple
+    per capability combination and ``attributes`` one dict per distinct
+    configuration (see ``DescriptorInterner``). The Google JSON shape is only
+    produced at the edge by ``to_dict``. Shared attribute dicts must never be
+    mutated.
+    """
+
+    __slots__ = ("id", "type", "traits", "name", "entity_id", "room_hint", "attributes")
+
+    def __init__(self, sid: str, dtype: str, traits: tuple, name: str, entity_id: str,
+                 room_hint: str | None = None, attributes: dict | None = None):
+        self.id = sid
+        self.type = dtype
+        self.traits = traits
+        self.name = name
+        self.entity_id = entity_id
+        self.room_hint = room_hint
+        self.attributes = attributes
+
+    def to_dict(self) -> dict:
+        dev = {
+            "id": self.id,
+            "type": self.type,
+            "traits": self.traits,
+            "name": {"name": self.name},
+            "willReportState": False,
+            "otherDeviceIds": ({"deviceId": self.entity_id},),
+        }
+        if self.room_hint is not None:
+            dev["roomHint"] = self.room_hint
+        if self.attributes:
+            dev["attributes"] = self.attributes
+        return dev
+
+    def _key(self) -> tuple:
+        return (self.id, self.type, self.traits, self.name, self.entity_id, self.room_hint, self.attributes)
+
+    def __eq__(self, other):
+        if not isinstance(other, SyncDevice):
+            return NotImplemented
+        return self._key() == other._key()
+
+    __hash__ = None  # attributes are dicts
+
+    def __repr__(self) -> str:
+        return f"SyncDevice({self.id!r}, {self.type!r}, {len(self.traits)} traits)"
+
+
+def as_dicts(devices) -> list:
+    """Google JSON shape of a list of ``SyncDevice`` (response edge)."""
+    return [d.to_dict() for d in devices]
+
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return tuple((k, _freeze(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return ("__seq__",) + tuple(_freeze(v) for v in obj)
+    return obj
+
+
+class DescriptorInterner:
+    """Shares trait tuples, attribute dicts and type strings between descriptors.
+
+    The tables only grow with the number of distinct capability combinations
+    and configurations (a handful of light models, thermostat units), not with
+    the number of devices.
+    """
+
+    def __init__(self):
+        self._traits: dict = {}  # tuple -> same tuple
+        self._attrs: dict = {}  # frozen key -> shared dict
+        self.hits = 0
+
+    def traits(self, traits) -> tuple:
+        key = tuple(traits)
+        shared = self._traits.get(key)
+        if shared is None:
+            shared = self._traits[key] = tuple(sys.intern(t) for t in key)
+        else:
+            self.hits += 1
+        return shared
+
+    def attributes(self, attrs: dict | None) -> dict | None:
+        if not attrs:
+            return None
+        try:
+            key = _freeze(attrs)
+            shared = self._attrs.get(key)
+        except TypeError:  # unhashable leaf value: keep private copy
+            return attrs
+        if shared is None:
+            shared = self._attrs[key] = attrs
+        else:
+            self.hits += 1
+        return shared
+
+    def device(self, sid: str, dtype: str, traits, name: str, entity_id: str,
+               room_hint: str | None = None, attrs: dict | None = None) -> SyncDevice:
+        return SyncDevice(sid, sys.intern(dtype), self.traits(traits), name, entity_id,
+                          room_hint, self.attributes(attrs))
+
+    def from_dict(self, dev: dict) -> SyncDevice:
+        """Descriptor from the Google JSON shape (persisted snapshot)."""
+        others = dev.get("otherDeviceIds") or ()
+        eid = others[0].get("deviceId") if others and isinstance(others[0], dict) else dev.get("id")
+        return self.device(
+            dev.get("id"),
+            dev.get("type") or "",
+            dev.get("traits") or (),
+            (dev.get("name") or {}).get("name") or eid,
+            eid,
+            dev.get("roomHint"),
+            dev.get("attributes"),
+        )
+
+    def stats(self) -> dict:
+        return {"traitSets": len(self._traits), "attributeSets": len(self._attrs), "hits": self.hits}
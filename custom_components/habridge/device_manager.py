@@ -1,5 +1,8 @@
 from __future__ import annotations
+from collections import deque
 from typing import Dict, List
+import hashlib
+import logging
 import re
 try:
     from homeassistant.helpers.storage import Store  # type: ignore
@@ -12,8 +15,22 @@ except Exception:  # noqa: BLE001
             return self._data
         async def async_save(self, data):  # noqa: D401
             self._data = data
+        def async_delay_save(self, data_func, delay=0):  # noqa: D401
+            self._data = data_func()
 
-from .const import DEFAULT_EXPOSE, STORAGE_IDMAP
+try:
+    from homeassistant.core import Context, callback  # type: ignore
+except Exception:  # noqa: BLE001
+    Context = None  # type: ignore
+    def callback(func):  # type: ignore
+        return func
+
+from .const import DEFAULT_EXPOSE, STORAGE_IDMAP, STORAGE_SNAPSHOT
+from .descriptors import DescriptorInterner, SyncDevice, as_dicts
+from .limiter import AdaptiveLimiter
+from .metrics import DeviceTimings, LatencyWindows
+from . import jsonenc, tracing
+from .persistence import DelayedSaves
 
 # HA Core >= 2025.x heeft ATTR_BRIGHTNESS mogelijk niet meer in homeassistant.const.
 # We gebruiken een lokale fallback string zodat de integratie niet breekt.
@@ -39,34 +56,262 @@ def _slugify_entity(eid: str) -> str:
     base = re.sub(r"[^a-zA-Z0-9_]+", "_", base)
     return base[:50].strip('_')
 
+# HA hvac_mode -> Google thermostatMode (gedeeld door SYNC en QUERY)
+HVAC_TO_GOOGLE = {
+    "off": "off",
+    "heat": "heat",
+    "cool": "cool",
+    "heat_cool": "heatcool",
+    "auto": "heatcool",
+    "fan_only": "fan-only",
+    "dry": "dry",
+}
+
+# ---- QUERY serializers (per device gekozen bij SYNC, daarna alleen aangeroepen) ----
+
+def _query_onoff(st) -> dict:
+    return {"on": st.state == "on", "online": True}
+
+def _query_light(st) -> dict:
+    resp = {"on": st.state == "on", "online": True}
+    attrs = st.attributes
+    bri = attrs.get("brightness")
+    if bri is not None:
+        try:
+            resp["brightness"] = int(round(bri * 100 / 255))
+        except Exception:  # noqa: BLE001
+            pass
+    cur = {}
+    rgb = attrs.get("rgb_color")
+    if rgb and isinstance(rgb, (list, tuple)) and len(rgb) == 3:
+        try:
+            r, g, b = rgb
+            cur["spectrumRgb"] = (int(r) << 16) + (int(g) << 8) + int(b)
+        except Exception:  # noqa: BLE001
+            pass
+    ct = attrs.get("color_temp")
+    if ct and isinstance(ct, (int, float)) and ct > 0:
+        try:
+            cur["temperatureK"] = int(round(1000000 / ct))
+        except Exception:  # noqa: BLE001
+            pass
+    if cur:
+        resp["currentColor"] = cur
+    return resp
+
+def _query_climate(st) -> dict:
+    attrs = st.attributes
+    g_mode = HVAC_TO_GOOGLE.get(st.state, "off")
+    resp = {"online": True, "thermostatMode": g_mode}
+    cur = attrs.get("current_temperature")
+    if cur is not None:
+        resp["thermostatTemperatureAmbient"] = cur
+    target = attrs.get("temperature")
+    if target is not None:
+        resp["thermostatTemperatureSetpoint"] = target
+    low = attrs.get("target_temp_low")
+    high = attrs.get("target_temp_high")
+    if low is not None and high is not None:
+        resp["thermostatTemperatureSetpointLow"] = low
+        resp["thermostatTemperatureSetpointHigh"] = high
+    fan_mode = attrs.get("fan_mode")
+    if fan_mode:
+        resp["currentFanSpeedSetting"] = f"speed_{fan_mode.lower()}"
+    resp["on"] = g_mode != "off"
+    return resp
+
+def _query_sensor_temperature(st) -> dict | None:
+    try:
+        val = float(st.state)
+    except Exception:  # noqa: BLE001
+        return None
+    return {"online": True, "thermostatMode": "off", "thermostatTemperatureAmbient": val}
+
+def _query_sensor_humidity(st) -> dict | None:
+    try:
+        val = float(st.state)
+    except Exception:  # noqa: BLE001
+        return None
+    return {"online": True, "humidityAmbientPercent": val}
+
+def _pick_query_serializer(domain: str, state):
+    """Return the QUERY serializer for a device, or None if it has no QUERY state.
+
+    Sensors need a loaded state to know their device_class; callers retry later
+    when None is returned for a sensor without state.
+    """
+    if domain == "switch":
+        return _query_onoff
+    if domain == "light":
+        return _query_light
+    if domain == "climate":
+        return _query_climate
+    if domain == "sensor" and state is not None:
+        dclass = state.attributes.get("device_class")
+        if dclass == "temperature":
+            return _query_sensor_temperature
+        if dclass == "humidity":
+            return _query_sensor_humidity
+    return None
+
+def _freeze(value):
+    """Hashable form of service data so identical calls can be grouped."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+# Volgorde voor acties op hetzelfde device die niet samengevoegd kunnen worden (lager = eerst).
+# Niet genoemde services krijgen 1 en behouden de volgorde van het request.
+_ACTION_ORDER = {
+    ("climate", "set_hvac_mode"): 0,
+    ("climate", "set_temperature"): 1,
+    ("climate", "set_fan_mode"): 2,
+}
+
+# Niet idempotent: nooit bundelen, zodat een mislukte batch niet per entity herhaald wordt
+_NO_BATCH_DOMAINS = ("script", "scene")
+
+# Service data keys die elkaar uitsluiten binnen één call; de laatst gevraagde wint
+_EXCLUSIVE_KEYS = (
+    ("rgb_color", "color_temp"),
+    # setpoint vs. range: climate.set_temperature accepts one of both, not together
+    ("temperature", "target_temp_low", "target_temp_high"),
+)
+
+def _coalesce_actions(actions: list) -> list:
+    """Merge one device's actions that target the same service into a single call.
+
+    OnOff + BrightnessAbsolute + ColorAbsolute on a light become one
+    ``light.turn_on`` carrying brightness/rgb_color/color_temp. Keys in one
+    ``_EXCLUSIVE_KEYS`` group replace each other (SetRange after a setpoint
+    keeps only the range). Remaining
+    actions are ordered by ``_ACTION_ORDER`` and otherwise request order.
+    On/off conflicts are resolved first: the last plain OnOff wins; when that
+    is off, every ``turn_on`` (including brightness/color data) is dropped,
+    otherwise the ``turn_off`` is dropped and the data folds into one turn_on.
+    """
+    actions = [a for a in actions if a is not None]
+    final_on = {}  # domain -> last plain OnOff (True = on)
+    for domain, service, data, _blocking in actions:
+        if service == "turn_off" or (service == "turn_on" and not data):
+            final_on[domain] = service == "turn_on"
+    merged = {}
+    order = []
+    for action in actions:
+        domain, service, data, blocking = action
+        if domain in final_on and service in ("turn_on", "turn_off"):
+            if service != ("turn_on" if final_on[domain] else "turn_off"):
+                continue
+        key = (domain, service)
+        cur = merged.get(key)
+        if cur is None:
+            merged[key] = (domain, service, dict(data), blocking)
+            order.append(key)
+            continue
+        cur_data = cur[2]
+        for group in _EXCLUSIVE_KEYS:
+            if any(k in data for k in group):
+                for k in group:
+                    cur_data.pop(k, None)
+        cur_data.update(data)
+        merged[key] = (domain, service, cur_data, cur[3] or blocking)
+    order.sort(key=lambda k: _ACTION_ORDER.get(k, 1))
+    return [merged[k] for k in order]
+
+# Exception class name (ergens in de MRO) -> Google errorCode; eerste match wint
+_ERROR_CODES = (
+    ("ServiceNotFound", "functionNotSupported"),
+    ("Unauthorized", "authFailure"),
+    ("ServiceValidationError", "valueOutOfRange"),
+    ("Invalid", "valueOutOfRange"),  # voluptuous
+    ("ValueError", "valueOutOfRange"),
+    ("TimeoutError", "timeout"),
+    ("HomeAssistantError", "hardError"),
+)
+
+def _google_error_code(exc: BaseException) -> str:
+    names = {c.__name__ for c in type(exc).__mro__}
+    for name, code in _ERROR_CODES:
+        if name in names:
+            return code
+    return "unknownError"
+
 class DeviceManager:
-    def __init__(self, hass, store, expose_domains):
+    def __init__(self, hass, store, expose_domains, saves: DelayedSaves | None = None):
         self.hass = hass
         self.store = store
+        self._saves = saves or DelayedSaves()
         self.expose_domains = expose_domains or DEFAULT_EXPOSE
         self._selections: Dict[str, bool] = {}
         self._idmap_store: Store | None = None
         self._stable_to_entity: Dict[str, str] = {}
         self._entity_to_stable: Dict[str, str] = {}
         # SYNC cache
-        self._sync_cache: list[dict] | None = None
+        self._sync_cache: list[SyncDevice] | None = None
+        self._interner = DescriptorInterner()  # shared traits / attributes of cached descriptors
+        # Encoded devices array of the last served list: (devices, bytes, hash)
+        self._sync_encoded: tuple | None = None
+        self._sync_hash_last: str | None = None
+        self._sync_hash_changes = 0
+        self._sync_hash_changed_ts: float | None = None
+        self._sync_encodes = 0
+        self._sync_streams = 0
         self._sync_cache_ts: float | None = None
         self._sync_cache_ttl = 8.0  # seconds
+        # Generation: bumped on every invalidation; builds of an old generation are not cached
+        self._sync_generation = 0
+        self._sync_inflight = None  # (generation, task)
+        self._sync_builds = 0
+        self._sync_shared_waits = 0
         # Debounce invalidation
         self._invalidate_handle = None
         self._invalidate_delay = 1.0
-        # Latency metrics (simple ring buffers)
-        self._lat_sync = []  # ms samples
-        self._lat_exec = []
-        self._lat_query = []
-        self._lat_max = 100
-        # Event loop lag samples
-        self._lag_samples = []  # ms
+        self._invalidate_warm = False
+        # Proactive SYNC warm-up after invalidation
+        self._warm_delay = 0.5
+        self._warm_task = None
+        self._sync_warm_builds = 0
+        self._sync_cache_hits = 0
+        self._sync_cache_source: str | None = None
+        # Warm start: SYNC payload + entity catalog snapshot, served until HA has started
+        import time as _t
+        self._snapshot_store: Store | None = None
+        self._snapshot_devices: list[SyncDevice] | None = None
+        self._snapshot_catalog: list[str] = []
+        self._snapshot_saved: float | None = None
+        self._snapshot_task = None
+        self._snapshot_delay = 30.0
+        self._snapshot_saves = 0
+        self._snapshot_last: tuple | None = None
+        self._live = False
+        self._boot = _t.monotonic()
+        self._live_after_ms: int | None = None
+        self._first_sync: tuple | None = None  # (ms since setup, source)
+        # Latency metrics: windowed log-linear histograms (1m / 15m / 24h)
+        self._latency = {k: LatencyWindows() for k in ("sync", "execute", "query", "loopLagMs")}
+        # Event loop lag: last samples only, for loop_overloaded()
         self._lag_max = 120
+        self._lag_samples = deque(maxlen=self._lag_max)  # ms
         self._lag_task = None
         # Per-device EXECUTE timing (recent durations ms)
-        self._exec_device_timings = {}
-        self._exec_device_last = {}
+        self._exec_device_timings = DeviceTimings(window=20)
+        # QUERY: stable id -> (entity_id, serializer) gekozen bij SYNC; memo per stable id
+        self._query_table: Dict[str, tuple] = {}
+        self._query_memo: Dict[str, tuple] = {}  # sid -> ((last_updated, context_id), fragment)
+        # EXECUTE: max wachttijd (s) op state_changed van eigen non-blocking calls
+        self._exec_state_wait = 0.5
+        # EXECUTE latency budget (settings exec_budget_ms / exec_budget_adaptive overrulen)
+        self._exec_budget_ms = 4000
+        self._exec_budget_floor_ms = 1000
+        self._exec_budget_p95_factor = 2.0
+        self._exec_background: set = set()
+        # Adaptive concurrency per integration (config entry / platform)
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._limiter_keys: Dict[str, str] = {}
+        # Failed service calls per (domain, Google errorCode), since start
+        self._service_errors: Dict[tuple, int] = {}
 
     def start_metrics(self):
         self._ensure_exec_metrics()
@@ -85,52 +330,154 @@ class DeviceManager:
             if drift < 0:
                 drift = 0
             self._lag_samples.append(drift)
-            if len(self._lag_samples) > self._lag_max:
-                self._lag_samples.pop(0)
+            self._latency["loopLagMs"].record(drift)
+
+    def loop_overloaded(self, threshold_ms: float = 250.0, window: int = 5) -> bool:
+        """True when the last ``window`` loop lag samples all exceed ``threshold_ms``."""
+        samples = self._lag_samples
+        if len(samples) < window:
+            return False
+        return min(samples[i] for i in range(-window, 0)) > threshold_ms
 
     def record_latency(self, kind: str, ms: float):
-        buf = None
-        if kind == 'sync':
-            buf = self._lat_sync
-        elif kind == 'exec':
-            buf = self._lat_exec
-        elif kind == 'query':
-            buf = self._lat_query
-        if buf is not None:
-            buf.append(ms)
-            if len(buf) > self._lat_max:
-                buf.pop(0)
+        hist = self._latency.get('execute' if kind == 'exec' else kind)
+        if hist is not None:
+            hist.record(ms)
 
     def latency_stats(self):
-        def stats(arr):
-            if not arr:
-                return {"count":0}
-            s = sorted(arr)
-            import math
-            def pct(p):
-                if not s:
-                    return None
-                idx = int(math.ceil(p/100.0 * len(s))) -1
-                idx = max(0, min(idx, len(s)-1))
-                return s[idx]
-            return {"count":len(s),"p50":pct(50),"p95":pct(95),"max":s[-1]}
-        return {
-            "sync": stats(self._lat_sync),
-            "execute": stats(self._lat_exec),
-            "query": stats(self._lat_query),
-            "loopLagMs": stats(self._lag_samples),
-        }
+        """Per kind: 15 min window in the legacy keys (count/p50/p95/max) plus all windows."""
+        import time
+        now = time.monotonic()
+        out = {}
+        for kind, hist in self._latency.items():
+            windows = hist.stats(now)
+            legacy = windows["15m"]
+            entry = {k: legacy[k] for k in ("count", "p50", "p95", "max") if k in legacy}
+            entry["windows"] = {
+                name: {k: w[k] for k in ("count", "p50", "p90", "p99", "max") if k in w}
+                for name, w in windows.items()
+            }
+            out[kind] = entry
+        return out
+
+    def _settings(self) -> dict:
+        data = self.hass.data.get('habridge') or {}
+        return data.get('settings') or {}
+
+    def exec_budget_ms(self, sid: str | None = None) -> int:
+        """EXECUTE budget for a device: configured cap, or p95 * factor when adaptive."""
+        settings = self._settings()
+        try:
+            cap = int(settings.get('exec_budget_ms') or self._exec_budget_ms)
+        except (TypeError, ValueError):
+            cap = self._exec_budget_ms
+        if sid is None or not settings.get('exec_budget_adaptive', True):
+            return cap
+        st = self._exec_device_timings.get(sid)
+        if not st or st["count"] < 5:
+            return cap
+        return int(min(cap, max(self._exec_budget_floor_ms, st["p95"] * self._exec_budget_p95_factor)))
 
     def invalidate_sync_cache(self):
         # Immediate (legacy) path kept for direct forcing
+        self._sync_generation += 1
+        self._sync_cache = None
+        self._sync_cache_ts = None
+        self._sync_cache_source = None
+        self._sync_encoded = None
+        self._limiter_keys = {}
+
+    def drop_sync_cache(self, _fraction: float = 1.0) -> int:
+        """Memory governor: drop the cached SYNC payload (rebuilt on the next SYNC)."""
+        if self._sync_cache is None:
+            return 0
+        n = len(self._sync_cache)
         self._sync_cache = None
         self._sync_cache_ts = None
+        self._sync_cache_source = None
+        self._sync_encoded = None
+        return n
+
+    def drop_sync_bytes(self, _fraction: float = 1.0) -> int:
+        """Memory governor: drop the encoded SYNC payload (re-encoded on the next SYNC)."""
+        if self._sync_encoded is None:
+            return 0
+        self._sync_encoded = None
+        return 1
+
+    def encoded_sync(self, devices) -> tuple[bytes, str]:
+        """JSON bytes of the devices array plus a content hash.
+
+        Encoded once per descriptor list (cache or snapshot) and reused by every
+        SYNC, sync_preview and trigger_sync until the next build, which replaces
+        the list. ``hashChanges`` counts builds whose payload actually differed.
+        """
+        enc = self._sync_encoded
+        if enc is not None and enc[0] is devices:
+            return enc[1], enc[2]
+        with tracing.span("sync.encode", devices=len(devices)):
+            body = jsonenc.dumps(as_dicts(devices))
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        self._sync_encodes += 1
+        self._note_sync_hash(digest)
+        self._sync_encoded = (devices, body, digest)
+        return body, digest
 
-    def debounce_invalidate(self):
-        # Schedule invalidate after short delay; collapse bursts
+    def iter_encoded_sync(self, devices, chunk: int = 200, slice_bytes: int = 64 * 1024):
+        """Yield the devices array as JSON byte chunks (streaming SYNC).
+
+        Already encoded bytes are sliced; otherwise ``chunk`` devices are
+        encoded at a time and the full payload is never held in memory. The
+        concatenation equals ``encoded_sync`` output, so the hash (computed
+        incrementally, available via ``sync_build_stats`` afterwards) matches.
+        """
+        enc = self._sync_encoded
+        if enc is not None and enc[0] is devices:
+            view = memoryview(enc[1])
+            for start in range(0, len(view), slice_bytes):
+                yield view[start:start + slice_bytes]
+            return
+        sha = hashlib.sha256()
+        if not devices:
+            sha.update(b"[]")
+            yield b"[]"
+        for start in range(0, len(devices), chunk):
+            part = jsonenc.dumps(as_dicts(devices[start:start + chunk]))
+            # splice the chunk arrays into one: "[a,b" + ",c,d" + ... + "]"
+            piece = (b"[" if start == 0 else b",") + part[1:-1]
+            if start + chunk >= len(devices):
+                piece += b"]"
+            sha.update(piece)
+            yield piece
+        self._sync_streams += 1
+        self._note_sync_hash(sha.hexdigest()[:16])
+
+    def _note_sync_hash(self, digest: str):
+        import time
+        if digest != self._sync_hash_last:
+            if self._sync_hash_last is not None:
+                self._sync_hash_changes += 1
+                self._sync_hash_changed_ts = time.time()
+            self._sync_hash_last = digest
+
+    def trim_exec_timings(self, _fraction: float = 1.0) -> int:
+        """Memory governor: forget timing history of devices that are no longer selected."""
+        if not self._query_table:
+            return 0  # table not built yet: every device would look unselected
+        return self._exec_device_timings.retain(self._query_table)
+
+    def debounce_invalidate(self, warm: bool = True):
+        # Schedule invalidate after short delay; collapse bursts.
+        # warm: rebuild the SYNC cache in the background afterwards (sticky within a burst)
         import asyncio
+        self._invalidate_warm = self._invalidate_warm or warm
         def do():
             self.invalidate_sync_cache()
+            if self._invalidate_warm:
+                self._invalidate_warm = False
+                # Selectie/alias gewijzigd voor HA gestart is: snapshot klopt niet meer
+                self._snapshot_devices = None
+                self._schedule_warm_build()
         if self._invalidate_handle:
             self._invalidate_handle.cancel()
         async def later():
@@ -139,7 +486,28 @@ class DeviceManager:
                 do()
             except Exception:  # noqa: BLE001
                 pass
-        self._invalidate_handle = self.hass.loop.create_task(later())
+        self._invalidate_handle = tracing.detached(self.hass.loop.create_task, later())
+
+    def _schedule_warm_build(self):
+        """Rebuild the SYNC payload on a low-priority background task after invalidation."""
+        import asyncio
+        if self._warm_task is not None and not self._warm_task.done():
+            self._warm_task.cancel()
+        async def warm():
+            # Laat eerst lopende requests / andere invalidaties voorgaan
+            await asyncio.sleep(self._warm_delay)
+            try:
+                await self.async_build_sync(source="warm")
+            except Exception as exc:  # noqa: BLE001
+                logging.getLogger(__name__).debug("habridge: SYNC warm-up failed: %s", exc)
+        self._warm_task = self._background_task(warm(), "habridge_sync_warmup")
+
+    def _background_task(self, coro, name: str):
+        # Outside any request context, so no trace is inherited (see tracing.detached)
+        create = getattr(self.hass, 'async_create_background_task', None)
+        if create is not None:
+            return tracing.detached(create, coro, name)
+        return tracing.detached(self.hass.loop.create_task, coro)
 
     async def async_load(self):
         data = await self.store.async_load()
@@ -153,11 +521,95 @@ class DeviceManager:
         else:
             self._stable_to_entity = {}
             self._entity_to_stable = {}
+        self._snapshot_store = Store(self.hass, 1, STORAGE_SNAPSHOT)
+        snap = await self._snapshot_store.async_load()
+        if isinstance(snap, dict) and not self._live:
+            selected = set(self.selected())
+            # alleen devices die nog geselecteerd zijn en dezelfde stable id houden
+            self._snapshot_devices = [
+                self._interner.from_dict(d) for d in snap.get("devices") or []
+                if self._stable_to_entity.get(d.get("id")) in selected
+            ] or None
+            self._snapshot_catalog = list(snap.get("catalog") or [])
+            self._snapshot_saved = snap.get("saved")
+
+    def go_live(self):
+        """Home Assistant has started: drop the snapshot and rebuild from live states."""
+        import time
+        if self._live:
+            return
+        self._live = True
+        self._live_after_ms = int((time.monotonic() - self._boot) * 1000)
+        self._snapshot_devices = None
+        self._snapshot_catalog = []
+        self.invalidate_sync_cache()
+        self._schedule_warm_build()
+
+    def note_first_sync(self, source: str):
+        """Record time-to-first-SYNC after setup (once)."""
+        import time
+        if self._first_sync is None:
+            self._first_sync = (int((time.monotonic() - self._boot) * 1000), source)
+
+    def sync_source(self) -> str:
+        return "snapshot" if (not self._live and self._snapshot_devices) else "live"
+
+    def _schedule_snapshot_save(self):
+        import asyncio
+        if self._snapshot_store is None or (self._snapshot_task is not None and not self._snapshot_task.done()):
+            return
+        async def later():
+            try:
+                await asyncio.sleep(self._snapshot_delay)
+                await self.async_save_snapshot()
+            except Exception as exc:  # noqa: BLE001
+                logging.getLogger(__name__).debug("habridge: snapshot save failed: %s", exc)
+        self._snapshot_task = self._background_task(later(), "habridge_snapshot_save")
+
+    async def async_save_snapshot(self):
+        """Persist the current live SYNC payload and entity catalog."""
+        import time
+        if not self._live or self._sync_cache is None or self._snapshot_store is None:
+            return
+        devices, catalog = self._sync_cache, self.list_entities()
+        if self._snapshot_last == (devices, catalog):
+            return  # unchanged since last save
+        self._snapshot_last = (devices, catalog)
+        self._snapshot_saved = time.time()
+        self._saves.schedule("snapshot", self._snapshot_store, self._snapshot_data)
+        self._snapshot_saves += 1
+
+    def _snapshot_data(self) -> dict:
+        # Built at write time only; no second copy of the SYNC payload is kept around
+        devices, catalog = self._snapshot_last or ((), [])
+        return {
+            "saved": self._snapshot_saved,
+            "devices": as_dicts(devices),
+            "catalog": catalog,
+        }
+
+    def warm_start_stats(self) -> dict:
+        import time
+        first = self._first_sync
+        return {
+            "live": self._live,
+            "liveAfterMs": self._live_after_ms,
+            "source": self.sync_source(),
+            "snapshotDevices": len(self._snapshot_devices or []),
+            "snapshotAgeS": int(time.time() - self._snapshot_saved) if self._snapshot_saved else None,
+            "snapshotSaves": self._snapshot_saves,
+            "firstSyncMs": first[0] if first else None,
+            "firstSyncSource": first[1] if first else None,
+        }
+
+    def _idmap_data(self) -> dict:
+        return {"entities": self._stable_to_entity, "reverse": self._entity_to_stable}
 
     async def async_persist(self):
-        await self.store.async_save(self._selections)
+        # Delayed writes: a burst of admin edits ends up as one write per store
+        self._saves.schedule("devices", self.store, lambda: self._selections)
         if self._idmap_store:
-            await self._idmap_store.async_save({"entities": self._stable_to_entity, "reverse": self._entity_to_stable})
+            self._saves.schedule("idmap", self._idmap_store, self._idmap_data)
 
     def list_entities(self) -> List[str]:
         # Prefer runtime states; fallback to entity registry for domains that may not yet have a state
@@ -176,6 +628,12 @@ class DeviceManager:
                     entities.append(ent.entity_id)
         except Exception:  # noqa: BLE001
             pass
+        if not self._live:
+            # States still loading: keep entities known from the last snapshot visible
+            for eid in self._snapshot_catalog:
+                if eid not in seen and eid.split('.')[0] in self.expose_domains:
+                    seen.add(eid)
+                    entities.append(eid)
         return entities
 
     def selected(self) -> List[str]:
@@ -185,7 +643,6 @@ class DeviceManager:
         if not self._selections:
             for eid in self.list_entities()[:limit]:
                 self._selections[eid] = True
-            await self.async_persist()
         # ensure mapping for selected
         for eid in self.selected():
             self._ensure_mapping(eid)
@@ -210,12 +667,91 @@ class DeviceManager:
     def resolve_entity(self, sid: str) -> str | None:
         return self._stable_to_entity.get(sid)
 
+    def _sync_fresh(self) -> bool:
+        import time
+        if self._sync_cache is None or self._sync_cache_ts is None:
+            return False
+        return (time.time() - self._sync_cache_ts) < self._sync_cache_ttl
+
     def build_sync(self):
         # Return cached result if still fresh
+        if self._sync_fresh():
+            self._sync_cache_hits += 1
+            return self._sync_cache
+        if not self._live and self._snapshot_devices:
+            return self._snapshot_devices
+        steps = self._build_sync_steps()
+        while True:
+            try:
+                next(steps)
+            except StopIteration as done:
+                return done.value
+
+    async def async_build_sync(self, force: bool = False, source: str = "request"):
+        """Single-flight SYNC build shared by all endpoints.
+
+        Concurrent callers await one in-flight build of the current generation;
+        ``force`` starts a new generation (TriggerSyncView). The build yields to
+        the event loop between chunks of devices. Returns ``SyncDevice``
+        descriptors; ``descriptors.as_dicts`` gives the Google JSON shape.
+        """
+        import asyncio
+        if force:
+            self.invalidate_sync_cache()
+        elif self._sync_fresh():
+            self._sync_cache_hits += 1
+            return self._sync_cache
+        elif not self._live and self._snapshot_devices:
+            return self._snapshot_devices
+        inflight = self._sync_inflight
+        if inflight is not None and inflight[0] == self._sync_generation:
+            self._sync_shared_waits += 1
+            return await asyncio.shield(inflight[1])
+        task = self.hass.loop.create_task(self._async_build_sync(source))
+        entry = (self._sync_generation, task)
+        self._sync_inflight = entry
+
+        def _clear(_t):
+            if self._sync_inflight is entry:
+                self._sync_inflight = None
+        task.add_done_callback(_clear)
+        return await asyncio.shield(task)
+
+    async def _async_build_sync(self, source: str = "request"):
+        import asyncio
+        steps = self._build_sync_steps(source=source)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as done:
+                return done.value
+            await asyncio.sleep(0)
+
+    def sync_build_stats(self) -> dict:
         import time
-        if self._sync_cache is not None and self._sync_cache_ts is not None:
-            if (time.time() - self._sync_cache_ts) < self._sync_cache_ttl:
-                return self._sync_cache
+        return {
+            "generation": self._sync_generation,
+            "builds": self._sync_builds,
+            "sharedWaits": self._sync_shared_waits,
+            "inFlight": self._sync_inflight is not None,
+            "warmBuilds": self._sync_warm_builds,
+            "cacheHits": self._sync_cache_hits,
+            "cacheSource": self._sync_cache_source,
+            "descriptors": self._interner.stats(),
+            "payloadHash": self._sync_hash_last,
+            "payloadBytes": len(self._sync_encoded[1]) if self._sync_encoded else None,
+            "encodes": self._sync_encodes,
+            "streams": self._sync_streams,
+            "hashChanges": self._sync_hash_changes,
+            "hashChangedAgeS": int(time.time() - self._sync_hash_changed_ts) if self._sync_hash_changed_ts else None,
+        }
+
+    def _build_sync_steps(self, chunk: int = 200, source: str = "request"):
+        """Generator behind build_sync: yields every ``chunk`` devices, returns the descriptors."""
+        generation = self._sync_generation
+        self._sync_builds += 1
+        if source == "warm":
+            self._sync_warm_builds += 1
         devices = []
         # Read global settings for roomHint toggle if available
         settings = {}
@@ -246,7 +782,10 @@ class DeviceManager:
                 area_device_fallback = stats.get('device_fallback', 0)
             except Exception:  # noqa: BLE001
                 area_lookup = None
-        for eid in self.selected():
+        query_table = {}
+        for n, eid in enumerate(self.selected()):
+            if n and n % chunk == 0:
+                yield
             state = self.hass.states.get(eid)
             # Allow inclusion even if state not yet loaded (e.g. after restart) so Google keeps device
             domain = state.domain if state else eid.split('.')[0]
@@ -317,18 +856,9 @@ class DeviceManager:
                     fan_modes = state.attributes.get("fan_modes")
                     if fan_modes:
                         traits.append("action.devices.traits.FanSpeed")
-                    mode_map = {
-                        "off": "off",
-                        "heat": "heat",
-                        "cool": "cool",
-                        "heat_cool": "heatcool",
-                        "auto": "heatcool",
-                        "fan_only": "fan-only",
-                        "dry": "dry",
-                    }
                     g_modes = []
                     for m in hvac_modes:
-                        gm = mode_map.get(m)
+                        gm = HVAC_TO_GOOGLE.get(m)
                         if gm and gm not in g_modes:
                             g_modes.append(gm)
                     if not g_modes:
@@ -395,31 +925,30 @@ class DeviceManager:
             if domain in ("scene", "script"):
                 # Use SCENE device type always
                 dtype = SUPPORTED_DOMAINS[domain][0]
-            dev = {
-                "id": sid,
-                "type": dtype,
-                "traits": traits,
-                "name": {"name": name},
-                "willReportState": False,
-                "otherDeviceIds": [{"deviceId": eid}],
-            }
-            if roomhint_enabled and area_lookup and eid in area_lookup:
-                dev["roomHint"] = area_lookup[eid]
-            if attrs:
-                dev["attributes"] = attrs
-            devices.append(dev)
-        # store cache
-        self._sync_cache = devices
-        try:
+            room = area_lookup.get(eid) if roomhint_enabled and area_lookup else None
+            # compact descriptor; JSON shape only at the response edge (SyncDevice.to_dict)
+            devices.append(self._interner.device(sid, dtype, traits, name, eid, room, attrs))
+            query_table[sid] = (eid, _pick_query_serializer(domain, state))
+        # store cache (only when nothing was invalidated while building)
+        if generation == self._sync_generation:
             import time as _t
+            # swap as one unit (no await in between)
+            self._sync_cache = devices
             self._sync_cache_ts = _t.time()
-        except Exception:  # noqa: BLE001
-            self._sync_cache_ts = None
+            self._sync_cache_source = source
+            self._query_table = query_table
+            for stale in [k for k in self._query_memo if k not in query_table]:
+                del self._query_memo[stale]
+            self._exec_device_timings.retain(query_table)
+            # registry lookups again on the next EXECUTE (entity may have moved entry)
+            self._limiter_keys = {}
+            if self._live:
+                self._schedule_snapshot_save()
         # Lightweight debug log (avoid large payload) – only when cache freshly built
         try:
             import logging as _lg
             lg = _lg.getLogger(__name__)
-            lg.debug("habridge: build_sync devices=%d roomHint=%s area_entity_hits=%d area_device_fb=%d aliases=%d", len(devices), roomhint_enabled, area_entity_hits, area_device_fallback, sum(1 for d in devices if 'name' in d and d['name'].get('name')))
+            lg.debug("habridge: build_sync devices=%d roomHint=%s area_entity_hits=%d area_device_fb=%d aliases=%d", len(devices), roomhint_enabled, area_entity_hits, area_device_fallback, sum(1 for d in devices if d.name))
         except Exception:  # noqa: BLE001
             pass
         return devices
@@ -472,12 +1001,170 @@ class DeviceManager:
             return None
         return int((time.time() - self._sync_cache_ts) * 1000)
 
+    def query_states(self, requested_ids=None) -> dict:
+        """Return QUERY states keyed by stable id (all selected when none requested)."""
+        if requested_ids:
+            sids = requested_ids
+        else:
+            sids = [self.stable_id(eid) for eid in self.selected()]
+        out = {}
+        for sid in sids:
+            frag = self.query_state(sid)
+            if frag is not None:
+                out[sid] = frag
+        return out
+
+    def query_state(self, sid: str) -> dict | None:
+        entry = self._query_table.get(sid)
+        if entry is None:
+            entry = self._register_query(sid)
+            if entry is None:
+                return None
+        eid, serializer = entry
+        st = self.hass.states.get(eid)
+        if not st:
+            return None
+        if serializer is None:
+            # Sensor zonder state tijdens SYNC: nu alsnog kiezen
+            serializer = _pick_query_serializer(st.domain, st)
+            if serializer is None:
+                return None
+            self._query_table[sid] = (eid, serializer)
+        ctx = getattr(st, 'context', None)
+        key = (st.last_updated, ctx.id if ctx is not None else None)
+        memo = self._query_memo.get(sid)
+        if memo is not None and memo[0] == key:
+            return memo[1]
+        frag = serializer(st)
+        if frag is not None:
+            self._query_memo[sid] = (key, frag)
+        return frag
+
+    def _register_query(self, sid: str):
+        # Device selected after the last SYNC build: add it to the table lazily
+        eid = self.resolve_entity(sid)
+        if not eid or not self._selections.get(eid):
+            return None
+        domain = eid.split('.')[0]
+        if domain not in SUPPORTED_DOMAINS:
+            return None
+        entry = (eid, _pick_query_serializer(domain, self.hass.states.get(eid)))
+        self._query_table[sid] = entry
+        return entry
+
+    def _drop_query(self, eid: str):
+        sid = self._entity_to_stable.get(eid)
+        if sid:
+            self._query_table.pop(sid, None)
+            self._query_memo.pop(sid, None)
+            self._exec_device_timings.evict(sid)
+
+    def _plan_device(self, state, exec_list) -> list:
+        """Translate the Google executions for one device into service call actions.
+
+        Each action is a ``(domain, service, data, blocking)`` tuple where ``data``
+        excludes ``entity_id`` so identical actions can be batched across devices.
+        """
+        domain = state.domain
+        actions = []
+        for exec_cmd in exec_list:
+            if not isinstance(exec_cmd, dict):
+                continue
+            ctype = exec_cmd.get("command")
+            params = exec_cmd.get("params", {}) or {}
+            if ctype == "action.devices.commands.OnOff" and domain in ("switch", "light"):
+                turn_on = params.get("on")
+                actions.append((domain, f"turn_{'on' if turn_on else 'off'}", {}, True))
+            elif ctype == "action.devices.commands.OnOff" and domain == "climate":
+                if params.get("on"):
+                    cur = state.state
+                    if cur and cur not in ("off", "unavailable", "unknown"):
+                        next_mode = cur
+                    else:
+                        pref = ["heat_cool", "auto", "cool", "heat"]
+                        hvac_modes = state.attributes.get("hvac_modes", [])
+                        next_mode = None
+                        for m in pref:
+                            if m in hvac_modes:
+                                next_mode = m
+                                break
+                        if not next_mode:
+                            next_mode = "heat"
+                else:
+                    next_mode = "off"
+                actions.append(("climate", "set_hvac_mode", {"hvac_mode": next_mode}, False))
+            elif ctype == "action.devices.commands.BrightnessAbsolute" and domain == "light" and "brightness" in params:
+                pct = params["brightness"]
+                bri = max(0, min(255, round(pct * 255 / 100)))
+                actions.append(("light", "turn_on", {"brightness": bri}, True))
+            elif ctype == "action.devices.commands.ThermostatSetMode" and domain == "climate":
+                mode = params.get("thermostatMode")
+                inv_map = {"off": "off", "heat": "heat", "cool": "cool", "heatcool": "heat_cool", "fan-only": "fan_only", "dry": "dry"}
+                ha_mode = inv_map.get(mode)
+                if ha_mode:
+                    actions.append(("climate", "set_hvac_mode", {"hvac_mode": ha_mode}, True))
+            elif ctype == "action.devices.commands.ThermostatTemperatureSetpoint" and domain == "climate":
+                temp = params.get("thermostatTemperatureSetpoint")
+                if temp is not None:
+                    actions.append(("climate", "set_temperature", {"temperature": temp}, True))
+            elif ctype == "action.devices.commands.ThermostatTemperatureSetRange" and domain == "climate":
+                low = params.get("thermostatTemperatureSetpointLow")
+                high = params.get("thermostatTemperatureSetpointHigh")
+                data = {}
+                if low is not None:
+                    data["target_temp_low"] = low
+                if high is not None:
+                    data["target_temp_high"] = high
+                actions.append(("climate", "set_temperature", data, True))
+            elif ctype == "action.devices.commands.SetFanSpeed" and domain == "climate":
+                fan_speed = params.get("fanSpeed")
+                if isinstance(fan_speed, str):
+                    fm = fan_speed[6:] if fan_speed.lower().startswith("speed_") else fan_speed
+                    actions.append(("climate", "set_fan_mode", {"fan_mode": fm}, True))
+            elif ctype == "action.devices.commands.ColorAbsolute" and domain == "light":
+                color = params.get("color") or {}
+                spec = color.get("spectrumRGB") or color.get("spectrumRgb")
+                temp_k = color.get("temperatureK") or color.get("temperaturek")
+                data = {}
+                try:
+                    if spec is not None:
+                        if isinstance(spec, str):
+                            spec_int = int(spec, 16) if spec.startswith("0x") else int(spec)
+                        else:
+                            spec_int = spec
+                        if isinstance(spec_int, int):
+                            data["rgb_color"] = [(spec_int >> 16) & 0xFF, (spec_int >> 8) & 0xFF, spec_int & 0xFF]
+                    elif temp_k is not None and isinstance(temp_k, (int, float)) and temp_k > 0:
+                        data["color_temp"] = int(round(1000000 / float(temp_k)))
+                except Exception:  # noqa: BLE001
+                    pass
+                actions.append(("light", "turn_on", data, False))
+            elif ctype == "action.devices.commands.ActivateScene" and domain in ("scene", "script"):
+                if params.get("deactivate"):
+                    # Scenes zijn niet omkeerbaar; wel als afgehandeld rapporteren
+                    actions.append(None)
+                elif domain == "script":
+                    service = "turn_on"
+                    if not self.hass.services.has_service("script", "turn_on") and self.hass.services.has_service("script", "run"):
+                        service = "run"
+                    actions.append(("script", service, {}, False))
+                else:
+                    actions.append(("scene", "turn_on", {}, False))
+        return actions
+
     async def execute(self, commands):
-        import asyncio
+        import asyncio, time
         self._ensure_exec_metrics()
+        trace = tracing.current()
+        t_plan = time.perf_counter()
         results = []
-        service_calls = []  # list of (sid, coroutine)
-        sid_tracking = []   # parallel list of stable id for each coroutine
+        handled = []  # stable ids in request order
+        errors = {}   # sid -> Google errorCode
+        # Plan per device and coalesce compatible actions. Each device runs its actions
+        # as its own sequential chain; actions of different devices that are ready in
+        # the same loop iteration are batched into one service call.
+        per_device = {}  # sid -> (eid, actions) over all command groups
+        chains = {}  # sid -> (eid, coalesced actions)
         for cmd in commands:
             exec_list = cmd.get("execution", [])
             devices = cmd.get("devices", [])
@@ -490,197 +1177,268 @@ class DeviceManager:
                 eid = self.resolve_entity(sid) or sid
                 state = self.hass.states.get(eid)
                 if not state:
+                    handled.append(sid)
+                    errors[sid] = "deviceNotFound"
                     continue
-                domain = state.domain
-                for exec_cmd in exec_list:
-                    if not isinstance(exec_cmd, dict):
-                        continue
-                    ctype = exec_cmd.get("command")
-                    params = exec_cmd.get("params", {}) or {}
-                    # Build coroutine per action
-                    if ctype == "action.devices.commands.OnOff" and domain in ("switch", "light"):
-                        turn_on = params.get("on")
-                        async def _do(eid=eid, domain=domain, turn_on=turn_on):
-                            await self.hass.services.async_call(domain, f"turn_{'on' if turn_on else 'off'}", {"entity_id": eid}, blocking=True)
-                        service_calls.append((sid, _do()))
-                        sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.OnOff" and domain == "climate":
-                        turn_on = params.get("on")
-                        async def _climate_toggle(eid=eid, state=state, turn_on=turn_on):
-                            if turn_on:
-                                cur = state.state
-                                if cur and cur not in ("off", "unavailable", "unknown"):
-                                    next_mode = cur
-                                else:
-                                    pref = ["heat_cool", "auto", "cool", "heat"]
-                                    hvac_modes = state.attributes.get("hvac_modes", [])
-                                    next_mode = None
-                                    for m in pref:
-                                        if m in hvac_modes:
-                                            next_mode = m
-                                            break
-                                    if not next_mode:
-                                        next_mode = "heat"
-                                await self.hass.services.async_call("climate", "set_hvac_mode", {"entity_id": eid, "hvac_mode": next_mode}, blocking=False)
-                            else:
-                                await self.hass.services.async_call("climate", "set_hvac_mode", {"entity_id": eid, "hvac_mode": "off"}, blocking=False)
-                        service_calls.append((sid, _climate_toggle()))
-                        sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.BrightnessAbsolute" and domain == "light" and "brightness" in params:
-                        pct = params["brightness"]
-                        bri = max(0, min(255, round(pct * 255 / 100)))
-                        async def _do_bri(eid=eid, bri=bri):
-                            await self.hass.services.async_call("light", "turn_on", {"entity_id": eid, "brightness": bri}, blocking=True)
-                        service_calls.append((sid, _do_bri()))
-                        sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.ThermostatSetMode" and domain == "climate":
-                        mode = params.get("thermostatMode")
-                        inv_map = {"off": "off", "heat": "heat", "cool": "cool", "heatcool": "heat_cool", "fan-only": "fan_only", "dry": "dry"}
-                        ha_mode = inv_map.get(mode)
-                        if ha_mode:
-                            async def _do_mode(eid=eid, ha_mode=ha_mode):
-                                await self.hass.services.async_call("climate", "set_hvac_mode", {"entity_id": eid, "hvac_mode": ha_mode}, blocking=True)
-                            service_calls.append((sid, _do_mode()))
-                            sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.ThermostatTemperatureSetpoint" and domain == "climate":
-                        temp = params.get("thermostatTemperatureSetpoint")
-                        if temp is not None:
-                            async def _do_temp(eid=eid, temp=temp):
-                                await self.hass.services.async_call("climate", "set_temperature", {"entity_id": eid, "temperature": temp}, blocking=True)
-                            service_calls.append((sid, _do_temp()))
-                            sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.ThermostatTemperatureSetRange" and domain == "climate":
-                        low = params.get("thermostatTemperatureSetpointLow")
-                        high = params.get("thermostatTemperatureSetpointHigh")
-                        data = {"entity_id": eid}
-                        if low is not None:
-                            data["target_temp_low"] = low
-                        if high is not None:
-                            data["target_temp_high"] = high
-                        async def _do_range(eid=eid, data=data):
-                            await self.hass.services.async_call("climate", "set_temperature", data, blocking=True)
-                        service_calls.append((sid, _do_range()))
-                        sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.SetFanSpeed" and domain == "climate":
-                        fan_speed = params.get("fanSpeed")
-                        if isinstance(fan_speed, str):
-                            fm = fan_speed[6:] if fan_speed.lower().startswith("speed_") else fan_speed
-                            async def _do_fan(eid=eid, fm=fm):
-                                await self.hass.services.async_call("climate", "set_fan_mode", {"entity_id": eid, "fan_mode": fm}, blocking=True)
-                            service_calls.append((sid, _do_fan()))
-                            sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.ColorAbsolute" and domain == "light":
-                        color = params.get("color") or {}
-                        spec = color.get("spectrumRGB") or color.get("spectrumRgb")
-                        temp_k = color.get("temperatureK") or color.get("temperaturek")
-                        async def _apply_color(eid=eid, spec=spec, temp_k=temp_k):
-                            data = {"entity_id": eid}
-                            try:
-                                if spec is not None:
-                                    if isinstance(spec, str):
-                                        if spec.startswith("0x"):
-                                            spec_int = int(spec, 16)
-                                        else:
-                                            spec_int = int(spec)
-                                    else:
-                                        spec_int = spec
-                                    if isinstance(spec_int, int):
-                                        r = (spec_int >> 16) & 0xFF
-                                        g = (spec_int >> 8) & 0xFF
-                                        b = spec_int & 0xFF
-                                        data["rgb_color"] = [r, g, b]
-                                elif temp_k is not None and isinstance(temp_k, (int,float)) and temp_k>0:
-                                    mired = int(round(1000000/float(temp_k)))
-                                    data["color_temp"] = mired
-                            except Exception:
-                                pass
-                            await self.hass.services.async_call("light", "turn_on", data, blocking=False)
-                        service_calls.append((sid, _apply_color()))
-                        sid_tracking.append(sid)
-                    elif ctype == "action.devices.commands.ActivateScene" and domain in ("scene", "script"):
-                        deactivate = params.get("deactivate")
-                        async def _activate_scene(eid=eid, domain=domain, deactivate=deactivate):
-                            if not deactivate:
-                                if domain == "script":
-                                    try:
-                                        if self.hass.services.has_service("script", "turn_on"):
-                                            await self.hass.services.async_call("script", "turn_on", {"entity_id": eid}, blocking=False)
-                                        elif self.hass.services.has_service("script", "run"):
-                                            await self.hass.services.async_call("script", "run", {"entity_id": eid}, blocking=False)
-                                    except Exception:
-                                        try:
-                                            await self.hass.services.async_call("script", "run", {"entity_id": eid}, blocking=False)
-                                        except Exception:
-                                            pass
-                                else:
-                                    await self.hass.services.async_call("scene", "turn_on", {"entity_id": eid}, blocking=False)
-                        service_calls.append((sid, _activate_scene()))
-                        sid_tracking.append(sid)
-        # Execute all service calls concurrently
-        if service_calls:
-            import time
-            tasks = []
-            for sid, coro in service_calls:
-                async def _timed(sid=sid, coro=coro):
-                    t0 = time.perf_counter()
-                    try:
-                        await coro
-                    except Exception:  # noqa: BLE001
-                        pass
-                    dt = int((time.perf_counter()-t0)*1000)
-                    lst = self._exec_device_timings.setdefault(sid, [])
-                    lst.append(dt)
-                    if len(lst) > 20:
-                        lst.pop(0)
-                    self._exec_device_last[sid] = dt
-                tasks.append(_timed())
+                if state.state == "unavailable":
+                    handled.append(sid)
+                    errors[sid] = "deviceOffline"
+                    continue
+                actions = self._plan_device(state, exec_list)
+                handled.append(sid)
+                if actions:
+                    per_device.setdefault(sid, (eid, []))[1].extend(actions)
+        for sid in handled:
+            # addressed, but none of its commands map to a service call
+            if sid not in per_device and sid not in errors:
+                errors[sid] = "functionNotSupported"
+        for sid, (eid, actions) in per_device.items():
+            coalesced = _coalesce_actions(actions)
+            if coalesced:
+                chains[sid] = (eid, coalesced)
+        if trace is not None:
+            trace.add("execute.plan", t_plan, time.perf_counter(), devices=len(per_device),
+                      actions=sum(len(a) for _e, a in chains.values()), errors=len(errors))
+        device_ms = {}
+        loop = asyncio.get_running_loop()
+        # Per device completion future
+        done_futs = {sid: loop.create_future() for sid in chains}
+        deadlines = {sid: self.exec_budget_ms(sid) / 1000.0 for sid in done_futs}
+        t_start = loop.time()
+        late = set()  # reported PENDING; finished in background
+        # Wait for state_changed caused by our own (non-blocking) calls, matched on context
+        contexts = set()
+        awaiting = {}  # eid -> sid
+        settled = asyncio.Event()
+        logger = logging.getLogger(__name__)
+
+        @callback
+        def _on_state(event):
+            new_state = event.data.get("new_state")
+            eid = event.data.get("entity_id")
+            if eid not in awaiting or new_state is None:
+                return
+            ctx = getattr(new_state, 'context', None)
+            if ctx is not None and (ctx.id in contexts or getattr(ctx, 'parent_id', None) in contexts):
+                del awaiting[eid]
+                if not awaiting:
+                    settled.set()
+
+        def _device_finished(sid):
+            dt = device_ms.get(sid, 0)
+            self._exec_device_timings.record(sid, dt)
+            if sid in late:
+                logger.info("habridge: EXECUTE background completion %s status=%s ms=%d", sid, errors.get(sid, "SUCCESS"), dt)
+            fut = done_futs[sid]
+            if not fut.done():
+                fut.set_result(None)
+
+        async def _timed(limiter, domain, service, data, blocking, targets) -> bool:
+            eids = [eid for _sid, eid in targets]
+            call_data = dict(data)
+            call_data["entity_id"] = eids[0] if len(eids) == 1 else eids
+            kwargs = {"blocking": blocking}
+            if Context is not None:
+                ctx = Context()
+                contexts.add(ctx.id)
+                kwargs["context"] = ctx
+                if not blocking:
+                    for sid, eid in targets:
+                        awaiting[eid] = sid
+            lane = trace.new_lane() if trace is not None else 0
+            t_wait = time.perf_counter()
+            await limiter.acquire()
+            t0 = time.perf_counter()
+            if trace is not None and t0 - t_wait > 0.0005:
+                trace.add("limiter.wait", t_wait, t0, lane)
+            ok = True
+            code = None
+            try:
+                await self.hass.services.async_call(domain, service, call_data, **kwargs)
+            except Exception as exc:  # noqa: BLE001
+                ok = False
+                code = _google_error_code(exc)
+                self._service_errors[(domain, code)] = self._service_errors.get((domain, code), 0) + 1
+                for sid, eid in targets:
+                    # a failed batch is retried per entity (_run_batch); only single calls assign errors
+                    if len(targets) == 1:
+                        errors.setdefault(sid, code)
+                    awaiting.pop(eid, None)
+                logger.warning("habridge: %s.%s failed for %s: %s (%s)", domain, service, eids, exc, code)
+            finally:
+                limiter.release()
+            t1 = time.perf_counter()
+            if trace is not None:
+                trace.add(f"call {domain}.{service}", t0, t1, lane, entities=",".join(eids), blocking=blocking, ok=ok, errorCode=code)
+            dt = int((t1-t0)*1000)
+            limiter.observe(dt, ok, batched=len(targets) > 1)
+            # Batched call: duration counts for every device in the batch
+            for sid, _eid in targets:
+                device_ms[sid] = device_ms.get(sid, 0) + dt
+            return ok
+
+        # Batches collect the actions submitted within one loop iteration; one HA service
+        # call per identical (integration, domain, service, data, blocking), so each call
+        # is governed by a single limiter
+        open_batches = {}  # key -> (limiter, domain, service, data, blocking, targets, future)
+        flush_scheduled = [False]
+
+        async def _run_batch(batch):
+            try:
+                ok = await _timed(*batch[:6])
+                targets = batch[5]
+                if not ok and len(targets) > 1:
+                    # One bad entity must not fail the whole batch: retry each target alone
+                    # (safe: only idempotent domains are batched, see _NO_BATCH_DOMAINS)
+                    await asyncio.gather(*[_timed(*batch[:5], [t]) for t in targets], return_exceptions=True)
+            finally:
+                if not batch[6].done():
+                    batch[6].set_result(None)
+
+        def _flush():
+            flush_scheduled[0] = False
+            batches = list(open_batches.values())
+            open_batches.clear()
+            for batch in batches:
+                task = loop.create_task(_run_batch(batch))
+                self._exec_background.add(task)
+                task.add_done_callback(self._exec_background.discard)
+
+        def _submit(sid, eid, action):
+            domain, service, data, blocking = action
+            lkey = self._limiter_key(eid)
+            key = (lkey, domain, service, _freeze(data), blocking)
+            if domain in _NO_BATCH_DOMAINS:
+                key += (eid,)  # own call per entity
+            batch = open_batches.get(key)
+            if batch is None:
+                batch = open_batches[key] = (self._limiter_for(lkey), domain, service, data, blocking, [], loop.create_future())
+            if (sid, eid) not in batch[5]:
+                batch[5].append((sid, eid))
+            if not flush_scheduled[0]:
+                flush_scheduled[0] = True
+                loop.call_soon(_flush)
+            return batch[6]
+
+        async def _run_device(sid, eid, actions):
             try:
-                await asyncio.gather(*tasks, return_exceptions=True)
+                for action in actions:
+                    await _submit(sid, eid, action)
+            finally:
+                _device_finished(sid)
+
+        async def _run_chains():
+            await asyncio.gather(*[_run_device(sid, eid, actions) for sid, (eid, actions) in chains.items()], return_exceptions=True)
+
+        unsub = None
+        if chains:
+            try:
+                unsub = self.hass.bus.async_listen("state_changed", _on_state)
             except Exception:  # noqa: BLE001
-                pass
-        # Build success results per sid (deduplicate)
+                unsub = None
+        try:
+            if chains:
+                run_task = loop.create_task(_run_chains())
+                # Calls keep running after the budget; keep a reference until they finish
+                self._exec_background.add(run_task)
+                run_task.add_done_callback(self._exec_background.discard)
+                waiting = dict(done_futs)
+                t_wait = time.perf_counter()
+                while waiting:
+                    now = loop.time()
+                    for sid in [s for s in waiting if waiting[s].done() or t_start + deadlines[s] <= now]:
+                        if not waiting.pop(sid).done():
+                            late.add(sid)
+                    if not waiting:
+                        break
+                    timeout = min(t_start + deadlines[s] for s in waiting) - now
+                    await asyncio.wait(list(waiting.values()), timeout=max(0.0, timeout), return_when=asyncio.FIRST_COMPLETED)
+                if trace is not None:
+                    trace.add("execute.wait", t_wait, time.perf_counter(), pending=len(late))
+            # Devices reported PENDING are not waited on
+            for eid, sid in list(awaiting.items()):
+                if sid in late:
+                    del awaiting[eid]
+            # Entities whose current state already carries our context are done
+            for eid in list(awaiting):
+                st = self.hass.states.get(eid)
+                ctx = getattr(st, 'context', None) if st else None
+                if ctx is not None and ctx.id in contexts:
+                    del awaiting[eid]
+            if awaiting and unsub is not None:
+                budget_left = max(deadlines.values()) - (loop.time() - t_start)
+                with tracing.span("execute.state_wait", entities=len(awaiting)) as sa:
+                    try:
+                        await asyncio.wait_for(settled.wait(), timeout=max(0.0, min(self._exec_state_wait, budget_left)))
+                    except asyncio.TimeoutError:
+                        sa["timedOut"] = len(awaiting)
+        finally:
+            if unsub is not None:
+                unsub()
+        if late:
+            logger.info("habridge: EXECUTE budget exceeded, PENDING=%s", sorted(late))
+        # Per-device result with post-execution state (same conversion as QUERY)
+        t_res = time.perf_counter()
         seen = set()
-        for sid in sid_tracking:
-            if sid not in seen:
-                results.append({"ids": [sid], "status": "SUCCESS"})
-                seen.add(sid)
+        for sid in handled:
+            if sid in seen:
+                continue
+            seen.add(sid)
+            if sid in late:
+                results.append({"ids": [sid], "status": "PENDING"})
+            elif sid in errors:
+                results.append({"ids": [sid], "status": "ERROR", "errorCode": errors[sid]})
+            else:
+                results.append({"ids": [sid], "status": "SUCCESS", "states": self.query_state(sid) or {"online": True}})
+        if trace is not None:
+            trace.add("execute.results", t_res, time.perf_counter(), results=len(results))
         return results
 
+    def _limiter_key(self, eid: str) -> str:
+        key = self._limiter_keys.get(eid)
+        if key is not None:
+            return key
+        key = eid.split('.')[0]
+        try:
+            from homeassistant.helpers import entity_registry as er  # type: ignore
+            ent = er.async_get(self.hass).async_get(eid)
+            if ent is not None:
+                if ent.config_entry_id:
+                    key = f"{ent.platform}:{ent.config_entry_id}"
+                elif ent.platform:
+                    key = ent.platform
+        except Exception:  # noqa: BLE001
+            pass
+        self._limiter_keys[eid] = key
+        return key
+
+    def _limiter_for(self, key: str) -> AdaptiveLimiter:
+        lim = self._limiters.get(key)
+        if lim is None:
+            lim = self._limiters[key] = AdaptiveLimiter()
+        return lim
+
+    def limiter_stats(self) -> dict:
+        """Concurrency limiter state per integration key."""
+        return {key: lim.stats() for key, lim in self._limiters.items()}
+
     def exec_device_stats(self):
-        """Return per-device execute timing stats (last, p50, p95, max)."""
-        import math
+        """Return per-device execute timing stats (count, last, p50, p95, max)."""
         self._ensure_exec_metrics()
-        out = {}
-        for sid, arr in self._exec_device_timings.items():
-            if not arr:
-                continue
-            s = sorted(arr)
-            def pct(p):
-                idx = int(math.ceil(p/100.0 * len(s))) - 1
-                if idx < 0: idx = 0
-                if idx >= len(s): idx = len(s)-1
-                return s[idx]
-            out[sid] = {
-                "count": len(s),
-                "last": self._exec_device_last.get(sid),
-                "p50": pct(50),
-                "p95": pct(95),
-                "max": s[-1],
-            }
-        return out
+        return self._exec_device_timings.stats()
 
     def _ensure_exec_metrics(self):
         # Defensive: create attrs if missing (older cached module / partial deploy)
-        if not hasattr(self, '_exec_device_timings'):
-            self._exec_device_timings = {}
-        if not hasattr(self, '_exec_device_last'):
-            self._exec_device_last = {}
+        if not isinstance(getattr(self, '_exec_device_timings', None), DeviceTimings):
+            self._exec_device_timings = DeviceTimings(window=20)
 
     def get_selection_map(self) -> Dict[str, bool]:
         return {eid: self._selections.get(eid, False) for eid in self.list_entities()}
 
     async def set_selection(self, entity_id: str, value: bool):
         self._selections[entity_id] = value
+        if not value:
+            self._drop_query(entity_id)
         await self.async_persist()
         self.debounce_invalidate()
 
@@ -692,6 +1450,8 @@ class DeviceManager:
             if self._selections.get(eid) != val:
                 self._selections[eid] = val
                 changed = True
+                if not val:
+                    self._drop_query(eid)
             # ensure stable mapping early (so SYNC won't drop it)
             if eid in current_entities:
                 self._ensure_mapping(eid)
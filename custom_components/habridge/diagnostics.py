@@ -0,0 +1,269 @@
+from __future__ import annotations
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+_STDLIB = os.path.normcase(sysconfig.get_paths().get("stdlib") or "")
+_SKIP_OUTER = ("asyncio" + os.sep, "selectors.py", "threading.py", "runpy.py")
+
+
+def _short(filename: str) -> str:
+    parts = filename.replace("\\", "/").split("/")
+    return "/".join(parts[-2:])
+
+
+def frame_stack(frame, limit: int = 64) -> list:
+    """Frames innermost first as ``(filename, lineno, function)``."""
+    out = []
+    while frame is not None and len(out) < limit:
+        code = frame.f_code
+        out.append((code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return out
+
+
+def _trim_outer(stack: list) -> list:
+    # Drop the event loop machinery (Handle._run / _run_once / run_forever) at the bottom
+    for i, (filename, _line, func) in enumerate(stack):
+        if i and func == "_run" and filename.endswith(os.path.join("asyncio", "events.py")):
+            return stack[:i]
+    end = len(stack)
+    while end > 1 and any(s in stack[end - 1][0] for s in _SKIP_OUTER):
+        end -= 1
+    return stack[:end]
+
+
+def _blame(stack: list):
+    """Innermost frame outside the standard library (the likely culprit)."""
+    for frame in stack:
+        if not os.path.normcase(frame[0]).startswith(_STDLIB):
+            return frame
+    return stack[0] if stack else None
+
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _idle(stack: list) -> bool:
+    # loop thread waiting in selector.select() -> nothing to run
+    return bool(stack) and stack[0][2] in ("select", "poll", "epoll") and stack[0][0].endswith("selectors.py")
+
+
+class StackSampler:
+    """Sample one thread's stacks for a while and fold them into collapsed stacks.
+
+    Runs in an executor thread: every ``interval_ms`` the target thread's frame
+    is read via ``sys._current_frames`` and its stack counted as one
+    ``root;...;leaf`` line (Brendan Gregg's collapsed format, as consumed by
+    flamegraph.pl, speedscope and inferno). Only ``running`` guards against a
+    second concurrent profile.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.runs = 0
+        self.last: dict | None = None
+
+    def sample(self, thread_id: int, seconds: float, interval_ms: float = 10.0, habridge_only: bool = False) -> dict:
+        """Blocking; call via ``hass.async_add_executor_job``."""
+        counts: dict = {}
+        interval = interval_ms / 1000.0
+        deadline = time.perf_counter() + seconds
+        samples = idle = 0
+        cost = 0.0
+        while True:
+            t0 = time.perf_counter()
+            if t0 >= deadline:
+                break
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = frame_stack(frame, limit=128)
+                del frame
+                samples += 1
+                if _idle(stack):
+                    idle += 1
+                    key = "(idle)"
+                else:
+                    key = self._fold(_trim_outer(stack), habridge_only)
+                counts[key] = counts.get(key, 0) + 1
+            t1 = time.perf_counter()
+            cost += t1 - t0
+            time.sleep(max(0.0, interval - (t1 - t0)))
+        self.runs += 1
+        self.last = {
+            "ts": int(time.time() * 1000),
+            "seconds": seconds,
+            "intervalMs": interval_ms,
+            "habridgeOnly": habridge_only,
+            "samples": samples,
+            "idle": idle,
+            "stacks": len(counts),
+            "sampleUsAvg": round(cost / samples * 1e6, 1) if samples else 0,
+        }
+        return counts
+
+    @staticmethod
+    def _fold(stack: list, habridge_only: bool) -> str:
+        names = []
+        for filename, _line, func in reversed(stack):  # root first
+            if habridge_only and not filename.startswith(_PACKAGE_DIR):
+                continue
+            names.append(f"{_short(filename)}:{func}".replace(";", ":").replace(" ", "_"))
+        if not names:
+            return "(other)"
+        return ";".join(names)
+
+    @staticmethod
+    def collapsed(counts: dict) -> str:
+        return "".join(f"{key} {n}\n" for key, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+
+# A check can land up to one interval after the last beat, so lateness up to
+# about one interval is plain scheduling jitter; stalls start well above that
+MIN_THRESHOLD_FACTOR = 5
+
+
+class BlockingWatchdog:
+    """Attribute event loop stalls to the code that was running.
+
+    A heartbeat callback on the loop updates a timestamp every ``interval_ms``;
+    a daemon thread checks it at the same rate. While the heartbeat is more
+    than ``threshold_ms`` late, the loop thread's current frame is sampled via
+    ``sys._current_frames`` and aggregated per call site. Overhead is one
+    callback plus one thread wake-up per interval; frames are only walked
+    during a stall. The threshold is kept at ``MIN_THRESHOLD_FACTOR`` times
+    the interval or more.
+    """
+
+    def __init__(self, hass, threshold_ms: float = 100.0, interval_ms: float = 20.0, top_n: int = 10, max_sites: int = 200):
+        self.hass = hass
+        self.interval_ms = interval_ms
+        self.threshold_ms = max(threshold_ms, interval_ms * MIN_THRESHOLD_FACTOR)
+        self.top_n = top_n
+        self.max_sites = max_sites
+        self._lock = threading.Lock()
+        self._sites: dict = {}  # site key -> aggregate
+        self._beat = 0.0
+        self._loop_thread: int | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._handle = None
+        self._stall_beat = None
+        self.stalls = 0
+        self.samples = 0
+        self.checks = 0
+        self._check_s = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def configure(self, enabled: bool, threshold_ms: float | None = None, interval_ms: float | None = None):
+        if threshold_ms is not None:
+            self.threshold_ms = max(20.0, float(threshold_ms))
+        if interval_ms is not None:
+            self.interval_ms = max(5.0, float(interval_ms))
+        self.threshold_ms = max(self.threshold_ms, self.interval_ms * MIN_THRESHOLD_FACTOR)
+        if enabled and not self.running:
+            self.start()
+        elif not enabled and self.running:
+            self.stop()
+
+    def start(self):
+        """Start from the event loop thread."""
+        self._loop_thread = threading.get_ident()
+        # fresh event per run so a thread from a previous run cannot be revived
+        self._stop = threading.Event()
+        self._beat = time.perf_counter()
+        self._tick()
+        self._thread = threading.Thread(target=self._watch, args=(self._stop,), name="habridge_watchdog", daemon=True)
+        self._thread.start()
+        LOGGER.info("habridge: blocking watchdog started (threshold=%sms interval=%sms)", self.threshold_ms, self.interval_ms)
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._thread = None
+
+    def _tick(self):
+        self._beat = time.perf_counter()
+        if not self._stop.is_set():
+            self._handle = self.hass.loop.call_later(self.interval_ms / 1000.0, self._tick)
+
+    def _watch(self, stop: threading.Event):
+        interval = self.interval_ms / 1000.0
+        while not stop.wait(interval):
+            t0 = time.perf_counter()
+            beat = self._beat
+            late_ms = (t0 - beat) * 1000.0 - self.interval_ms
+            self.checks += 1
+            if late_ms >= self.threshold_ms:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._record(frame_stack(frame), beat, late_ms)
+                del frame
+            self._check_s += time.perf_counter() - t0
+            interval = self.interval_ms / 1000.0
+
+    def _record(self, stack: list, beat: float, late_ms: float):
+        stack = _trim_outer(stack)
+        site = _blame(stack)
+        if site is None:
+            return
+        key = f"{_short(site[0])}:{site[1]} {site[2]}"
+        new_stall = beat != self._stall_beat
+        self._stall_beat = beat
+        self.samples += 1
+        with self._lock:
+            agg = self._sites.get(key)
+            if agg is None:
+                if len(self._sites) >= self.max_sites:
+                    # drop the site with the least blocked time
+                    weakest = min(self._sites, key=lambda k: self._sites[k]["blockedMs"])
+                    del self._sites[weakest]
+                agg = self._sites[key] = {
+                    "site": key,
+                    "stack": [f"{_short(f)}:{ln} {fn}" for f, ln, fn in stack[:12]],
+                    "stalls": 0,
+                    "samples": 0,
+                    "blockedMs": 0.0,
+                    "maxMs": 0.0,
+                    "last": 0,
+                }
+            agg["samples"] += 1
+            agg["blockedMs"] += self.interval_ms
+            if new_stall:
+                agg["stalls"] += 1
+                agg["blockedMs"] += late_ms - self.interval_ms
+            agg["maxMs"] = max(agg["maxMs"], late_ms)
+            agg["last"] = int(time.time() * 1000)
+        if new_stall:
+            self.stalls += 1
+
+    def reset(self) -> int:
+        with self._lock:
+            n = len(self._sites)
+            self._sites.clear()
+        self.stalls = self.samples = 0
+        return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            top = sorted(self._sites.values(), key=lambda a: a["blockedMs"], reverse=True)[: self.top_n]
+            top = [{**a, "blockedMs": int(a["blockedMs"]), "maxMs": int(a["maxMs"])} for a in top]
+        return {
+            "enabled": self.running,
+            "thresholdMs": self.threshold_ms,
+            "intervalMs": self.interval_ms,
+            "stalls": self.stalls,
+            "samples": self.samples,
+            "checkUsAvg": round(self._check_s / self.checks * 1e6, 1) if self.checks else 0,
+            "top": top,
+        }
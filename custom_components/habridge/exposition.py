@@ -0,0 +1,120 @@
+from __future__ import annotations
+from .metrics import EXPORT_BOUNDS_MS
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+_LE = [f"{b / 1000:g}" for b in EXPORT_BOUNDS_MS] + ["+Inf"]
+
+
+def _esc(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items()) + "}"
+
+
+class _Writer:
+    def __init__(self):
+        self.lines: list = []
+
+    def family(self, name: str, kind: str, help_text: str, unit: str | None = None):
+        self.lines.append(f"# TYPE {name} {kind}")
+        if unit:
+            self.lines.append(f"# UNIT {name} {unit}")
+        self.lines.append(f"# HELP {name} {help_text}")
+
+    def sample(self, name: str, value, labels: dict | None = None):
+        self.lines.append(f"{name}{_labels(labels or {})} {value}")
+
+    def histogram(self, name: str, counts, count: int, total_ms: float, labels: dict | None = None):
+        labels = labels or {}
+        acc = 0
+        for le, c in zip(_LE, counts):
+            acc += c
+            self.sample(f"{name}_bucket", acc, {**labels, "le": le})
+        self.sample(f"{name}_count", count, labels)
+        self.sample(f"{name}_sum", round(total_ms / 1000, 6), labels)
+
+
+def render(device_mgr, token_mgr=None, smart_view=None, saves=None) -> str:
+    """Render bridge counters in OpenMetrics text format.
+
+    Only reads counters that are already maintained; never builds SYNC or
+    walks registries, so it can be scraped every few seconds.
+    """
+    w = _Writer()
+    lat = device_mgr._latency
+
+    w.family("habridge_intent_duration_seconds", "histogram", "Fulfillment duration per intent.", "seconds")
+    for intent in ("sync", "query", "execute"):
+        h = lat[intent]
+        w.histogram("habridge_intent_duration_seconds", h.total, h.total_count, h.total_sum, {"intent": intent})
+
+    h = lat["loopLagMs"]
+    w.family("habridge_event_loop_lag_seconds", "histogram", "Event loop lag sampled every second.", "seconds")
+    w.histogram("habridge_event_loop_lag_seconds", h.total, h.total_count, h.total_sum)
+
+    w.family("habridge_execute_device_duration_seconds", "histogram", "EXECUTE duration per selected device.", "seconds")
+    for sid, counts, count, total in device_mgr._exec_device_timings.histograms():
+        w.histogram("habridge_execute_device_duration_seconds", counts, count, total, {"device": sid})
+
+    sb = device_mgr.sync_build_stats()
+    w.family("habridge_sync_cache_hits", "counter", "SYNC requests served from the cache.")
+    w.sample("habridge_sync_cache_hits_total", sb["cacheHits"])
+    w.family("habridge_sync_builds", "counter", "SYNC payload builds.")
+    w.sample("habridge_sync_builds_total", sb["builds"] - sb["warmBuilds"], {"source": "request"})
+    w.sample("habridge_sync_builds_total", sb["warmBuilds"], {"source": "warm"})
+    w.family("habridge_sync_shared_waits", "counter", "SYNC callers that joined an in-flight build.")
+    w.sample("habridge_sync_shared_waits_total", sb["sharedWaits"])
+    w.family("habridge_sync_invalidations", "counter", "SYNC cache invalidations.")
+    w.sample("habridge_sync_invalidations_total", sb["generation"])
+    w.family("habridge_sync_cache_age_seconds", "gauge", "Age of the cached SYNC payload.", "seconds")
+    age = device_mgr.sync_cache_age_ms()
+    if age is not None:
+        w.sample("habridge_sync_cache_age_seconds", age / 1000)
+
+    w.family("habridge_selected_devices", "gauge", "Devices selected for Google.")
+    w.sample("habridge_selected_devices", len(device_mgr.selected()))
+
+    w.family("habridge_service_call_errors", "counter", "Failed EXECUTE service calls per domain and Google errorCode.")
+    for (domain, code), n in sorted(device_mgr._service_errors.items()):
+        w.sample("habridge_service_call_errors_total", n, {"domain": domain, "code": code})
+
+    w.family("habridge_execute_limit", "gauge", "Adaptive concurrency limit per integration.")
+    limiters = device_mgr.limiter_stats()
+    for key, st in sorted(limiters.items()):
+        w.sample("habridge_execute_limit", st["limit"], {"integration": key})
+    w.family("habridge_execute_limit_decreases", "counter", "Limit decreases per integration.")
+    for key, st in sorted(limiters.items()):
+        w.sample("habridge_execute_limit_decreases_total", st["decreases"], {"integration": key})
+
+    if token_mgr is not None:
+        w.family("habridge_tokens", "gauge", "Stored OAuth codes and refresh tokens.")
+        for kind, n in token_mgr.token_counts().items():
+            w.sample("habridge_tokens", n, {"kind": kind})
+
+    if smart_view is not None:
+        adm = smart_view._admission.stats()
+        w.family("habridge_admission_in_flight", "gauge", "Smarthome requests in flight per intent class.")
+        for klass, st in adm.items():
+            w.sample("habridge_admission_in_flight", st["inFlight"], {"class": klass})
+        w.family("habridge_admission_rejected", "counter", "Requests rejected (queue timeout or shed) per intent class.")
+        for klass, st in adm.items():
+            w.sample("habridge_admission_rejected_total", st["rejected"], {"class": klass, "reason": "queue_timeout"})
+            w.sample("habridge_admission_rejected_total", st["shed"], {"class": klass, "reason": "overloaded"})
+        rp = smart_view._replay.stats()
+        w.family("habridge_execute_replays", "counter", "EXECUTE retries answered from the replay cache.")
+        w.sample("habridge_execute_replays_total", rp["hitsInflight"], {"kind": "inflight"})
+        w.sample("habridge_execute_replays_total", rp["hitsCached"], {"kind": "cached"})
+
+    if saves is not None:
+        ps = saves.stats()
+        w.family("habridge_store_saves", "counter", "Delayed store saves requested and writes performed.")
+        w.sample("habridge_store_saves_total", ps["scheduled"], {"kind": "scheduled"})
+        w.sample("habridge_store_saves_total", ps["written"], {"kind": "written"})
+
+    w.lines.append("# EOF")
+    return "\n".join(w.lines) + "\n"
@@ -3,8 +3,10 @@ from homeassistant.components.http import HomeAssistantView
 from homeassistant.core import HomeAssistant
 from homeassistant.const import __version__ as HA_VERSION
 from aiohttp import web
+import hashlib
 import json
 import logging
+import threading
 
 from .const import (
     OAUTH_PATH,
@@ -14,6 +16,19 @@ from .const import (
 )
 from .token_manager import TokenManager
 from .device_manager import DeviceManager
+from .request_control import ReplayCache, AdmissionController, AdmissionRejected
+from . import exposition
+from .jsonenc import BACKEND as JSON_BACKEND, dumps as json_dumps, loads as json_loads, json_response
+from .diagnostics import MIN_THRESHOLD_FACTOR, StackSampler
+from .memory import set_tracemalloc, tracemalloc_top
+from .tracing import DEFAULT_SLOW_MS, SlowLog, Tracer, span, current as current_trace
+
+# Google intent -> admission class (zie AdmissionController)
+INTENT_CLASSES = {
+    "action.devices.EXECUTE": "execute",
+    "action.devices.SYNC": "sync",
+    "action.devices.QUERY": "query",
+}
 
 class OAuthView(HomeAssistantView):
     url = OAUTH_PATH
@@ -50,15 +65,15 @@ class TokenView(HomeAssistantView):
             code = data.get("code")
             td = await self.token_mgr.exchange_code(code)
             if not td:
-                return web.json_response({"error": "invalid_grant"}, status=400)
-            return web.json_response(td.__dict__)
+                return json_response({"error": "invalid_grant"}, status=400)
+            return json_response(td.__dict__)
         if grant_type == "refresh_token":
             refresh_token = data.get("refresh_token")
             td = await self.token_mgr.refresh(refresh_token)
             if not td:
-                return web.json_response({"error": "invalid_grant"}, status=400)
-            return web.json_response(td.__dict__)
-        return web.json_response({"error": "unsupported_grant_type"}, status=400)
+                return json_response({"error": "invalid_grant"}, status=400)
+            return json_response(td.__dict__)
+        return json_response({"error": "unsupported_grant_type"}, status=400)
 
 class SmartHomeView(HomeAssistantView):
     url = SMARTHOME_PATH
@@ -71,6 +86,10 @@ class SmartHomeView(HomeAssistantView):
         self.device_mgr = device_mgr
         self.client_secret = client_secret
         self._log_buf: list[dict] = []
+        self._replay = ReplayCache()
+        self._admission = AdmissionController(overloaded=getattr(device_mgr, 'loop_overloaded', None))
+        self._tracer = Tracer(max_traces=50)
+        self._slow = SlowLog()
         # Start metrics sampling if available
         try:
             if hasattr(self.device_mgr, 'start_metrics'):
@@ -89,175 +108,230 @@ class SmartHomeView(HomeAssistantView):
         if len(self._log_buf) > 50:
             self._log_buf.pop(0)
 
+    @staticmethod
+    def _agent_key(request) -> str:
+        # Agent = the credential Google presents; hashed so tokens are not kept in memory twice
+        auth = request.headers.get("Authorization") or ""
+        if not auth:
+            return "anonymous"
+        return hashlib.sha256(auth.encode("utf-8", errors="replace")).hexdigest()[:16]
+
     async def post(self, request):
-        logger = logging.getLogger(__name__)
-        import time as _t
-        t_start = _t.perf_counter()
-        # Debounced invalidation (was invalidate_sync_cache previously)
+        # Trace per request (spans via tracing.span / tracing.current in DeviceManager)
+        trace = self._tracer.start()
+        try:
+            response = await self._post(request, trace)
+        finally:
+            self._tracer.finish(trace)
+            self._check_slow(trace)
+        if not response.prepared:  # streamed SYNC sets it before prepare
+            response.headers["X-Habridge-Trace"] = trace.trace_id
+        return response
+
+    def slow_thresholds(self) -> dict:
+        data = self.hass.data.get('habridge') or {}
+        configured = (data.get('settings') or {}).get('slow_ms') or {}
+        return {k: configured.get(k, v) for k, v in DEFAULT_SLOW_MS.items()}
+
+    def _check_slow(self, trace):
+        klass = (trace.intent or '').lower()
+        threshold = self.slow_thresholds().get(klass)
+        if threshold is None or trace.duration_ms() < threshold:
+            return
+        lag = {}
         try:
-            self.device_mgr.debounce_invalidate()
+            samples = self.device_mgr._lag_samples
+            lag_1m = self.device_mgr._latency["loopLagMs"].window("1m")
+            lag = {"last": round(samples[-1], 1) if samples else None, "p99_1m": lag_1m.get("p99"), "max_1m": lag_1m.get("max")}
         except Exception:  # noqa: BLE001
             pass
-        raw_bytes = await request.read()
+        self._slow.add(trace, threshold, lag)
+
+    async def _post(self, request, trace):
+        logger = logging.getLogger(__name__)
+        t_start = trace.t0
+        with span("read_body") as sa:
+            raw_bytes = await request.read()
+            sa["bytes"] = len(raw_bytes)
         try:
-            # Probeer directe json.loads voor meer controle / fout logging
-            body = json.loads(raw_bytes.decode('utf-8', errors='replace'))
+            # Direct van bytes (orjson indien beschikbaar) voor meer controle / fout logging
+            with span("parse_json"):
+                body = json_loads(raw_bytes)
         except Exception as exc:  # noqa: BLE001
             preview = raw_bytes[:200]
             logger.warning("habridge: invalid JSON body (%s) raw=%r", exc, preview)
             self._push_log("ERROR", f"invalid_json len={len(raw_bytes)}")
-            return web.json_response({"requestId": "invalid", "payload": {"errorCode": "protocolError"}}, status=400)
+            return json_response({"requestId": "invalid", "payload": {"errorCode": "protocolError"}}, status=400)
         inputs = body.get("inputs") if isinstance(body, dict) else None
         if not inputs or not isinstance(inputs, list) or not inputs:
             logger.warning("habridge: malformed body missing inputs key: %s", body)
             self._push_log("ERROR", "malformed_payload_no_inputs")
-            return web.json_response({"requestId": body.get("requestId", "invalid"), "payload": {"errorCode": "protocolError"}}, status=400)
+            return json_response({"requestId": body.get("requestId", "invalid"), "payload": {"errorCode": "protocolError"}}, status=400)
         intent = inputs[0].get("intent")
         request_id = body.get("requestId", "req")
+        trace.request_id = request_id
+        trace.intent = (intent or "UNKNOWN").split('.')[-1]
         logger.debug("habridge: intent=%s requestId=%s raw=%s", intent, request_id, body)
+        klass = INTENT_CLASSES.get(intent)
+        if klass is not None:
+            try:
+                with span("admission", klass=klass) as sa:
+                    sa["queueMs"] = round(await self._admission.acquire(klass), 1)
+            except AdmissionRejected as rej:
+                logger.warning("habridge: %s not admitted (%s)", intent, rej.reason)
+                self._push_log("SHED", f"{klass} reason={rej.reason}", request_id)
+                return json_response({"requestId": request_id, "payload": {"errorCode": "transientError"}})
+        try:
+            return await self._handle_intent(request, inputs, intent, request_id, t_start)
+        finally:
+            if klass is not None:
+                self._admission.release(klass)
+
+    @staticmethod
+    def _respond(payload: dict, status: int = 200):
+        with span("serialize"):
+            return json_response(payload, status=status)
+
+    @staticmethod
+    def _sync_body(request_id, devices_json: bytes) -> bytes:
+        # Splice requestId / agentUserId around the pre-encoded devices array
+        return b"".join((
+            b'{"requestId":', json_dumps(request_id),
+            b',"payload":{"agentUserId":"user","devices":', devices_json, b"}}",
+        ))
+
+    async def _stream_sync(self, request, request_id, devices, dt: int, source: str):
+        """SYNC as a chunked StreamResponse: envelope first, then device chunks as they are encoded."""
+        import asyncio
+        logger = logging.getLogger(__name__)
+        trace = current_trace()
+        resp = web.StreamResponse(headers={"X-Habridge-Trace": trace.trace_id} if trace is not None else None)
+        resp.content_type = "application/json"
+        resp.enable_chunked_encoding()
+        sent = 0
+        with span("serialize", streamed=True) as sa:
+            await resp.prepare(request)
+            # Headers are out: from here on errors end the stream, never a second (500) response.
+            # CancelledError (client timeout) is not an Exception and propagates as usual.
+            try:
+                head = b'{"requestId":' + json_dumps(request_id) + b',"payload":{"agentUserId":"user","devices":'
+                await resp.write(head)
+                sent += len(head)
+                for piece in self.device_mgr.iter_encoded_sync(devices):
+                    await resp.write(piece)
+                    sent += len(piece)
+                    await asyncio.sleep(0)  # keep the loop responsive between chunks
+                await resp.write(b"}}")
+                await resp.write_eof()
+            except ConnectionResetError as exc:
+                logger.debug("habridge: SYNC stream aborted by client after %d bytes: %s", sent, exc)
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("habridge: SYNC stream failed after %d bytes: %s", sent, exc)
+                self._push_log("ERROR", f"sync_stream_failed sent={sent}B {type(exc).__name__}", request_id)
+                resp.force_close()
+            sa["bytes"] = sent
+        digest = self.device_mgr.sync_build_stats().get("payloadHash")
+        logger.info("habridge: SYNC streams %d devices in %dms (%s, hash=%s)", len(devices), dt, source, digest)
+        self._push_log("SYNC", f"devices={len(devices)} timeMs={dt} source={source} hash={digest} streamed={sent}B", request_id)
+        try:
+            self.device_mgr.record_latency('sync', dt)
+        except Exception:  # noqa: BLE001
+            pass
+        return resp
+
+    async def _handle_intent(self, request, inputs, intent, request_id, t_start):
+        logger = logging.getLogger(__name__)
+        import time as _t
         try:
             if intent == "action.devices.SYNC":
-                devices = self.device_mgr.build_sync()
+                # Concurrent SYNCs (and status/preview polls) share one build
+                with span("sync.build") as sa:
+                    devices = await self.device_mgr.async_build_sync()
+                    sa["devices"] = len(devices)
                 dt = int(( _t.perf_counter() - t_start)*1000)
-                logger.info("habridge: SYNC returns %d devices in %dms", len(devices), dt)
-                self._push_log("SYNC", f"devices={len(devices)} timeMs={dt}", request_id)
+                source = self.device_mgr.sync_source()
+                self.device_mgr.note_first_sync(source)
+                trace = current_trace()
+                if trace is not None:
+                    trace.shape = {"devices": len(devices), "source": source}
+                settings = (self.hass.data.get('habridge') or {}).get('settings') or {}
+                if settings.get('sync_streaming'):
+                    return await self._stream_sync(request, request_id, devices, dt, source)
+                devices_json, digest = self.device_mgr.encoded_sync(devices)
+                logger.info("habridge: SYNC returns %d devices in %dms (%s, hash=%s)", len(devices), dt, source, digest)
+                self._push_log("SYNC", f"devices={len(devices)} timeMs={dt} source={source} hash={digest}", request_id)
                 try:
                     self.device_mgr.record_latency('sync', dt)
                 except Exception:  # noqa: BLE001
                     pass
-                return web.json_response({"requestId": request_id, "payload": {"agentUserId": "user", "devices": devices}})
+                with span("serialize", bytes=len(devices_json)):
+                    return web.Response(
+                        body=self._sync_body(request_id, devices_json),
+                        content_type="application/json",
+                        headers={"X-Habridge-Sync-Hash": digest},
+                    )
             if intent == "action.devices.QUERY":
                 q_parse_start = _t.perf_counter()
                 # Determine requested stable ids (Google passes either ids or device objects)
                 requested_ids = set()
-                try:
-                    payload = inputs[0].get("payload", {}) if isinstance(inputs[0], dict) else {}
-                    devs = payload.get("devices", []) if isinstance(payload, dict) else []
-                    for d in devs:
-                        if isinstance(d, dict):
-                            rid = d.get("id") or d.get("deviceId")
-                            if rid:
-                                requested_ids.add(rid)
-                except Exception:  # noqa: BLE001
-                    requested_ids = set()
-                selected_eids = list(self.device_mgr.selected())
-                # Map stable id -> entity id for quick filter
-                sid_to_eid = {}
-                for eid in selected_eids:
-                    sid_to_eid[self.device_mgr.stable_id(eid)] = eid
-                target_pairs = []
-                if requested_ids:
-                    for sid in requested_ids:
-                        eid = sid_to_eid.get(sid)
-                        if eid:
-                            target_pairs.append((sid, eid))
-                else:
-                    # fallback: old behavior (all selected)
-                    for eid in selected_eids:
-                        sid = self.device_mgr.stable_id(eid)
-                        target_pairs.append((sid, eid))
-                devices = {}
+                with span("query.lookup") as sa:
+                    try:
+                        payload = inputs[0].get("payload", {}) if isinstance(inputs[0], dict) else {}
+                        devs = payload.get("devices", []) if isinstance(payload, dict) else []
+                        for d in devs:
+                            if isinstance(d, dict):
+                                rid = d.get("id") or d.get("deviceId")
+                                if rid:
+                                    requested_ids.add(rid)
+                    except Exception:  # noqa: BLE001
+                        requested_ids = set()
+                    selected_count = len(self.device_mgr.selected())
+                    sa["requested"] = len(requested_ids)
                 build_start = _t.perf_counter()
-                for sid, eid in target_pairs:
-                    st = self.hass.states.get(eid)
-                    if not st:
-                        continue
-                    domain = st.domain
-                    if domain in ("switch", "light"):
-                        resp = {"on": st.state == "on", "online": True}
-                        if domain == "light" and st.attributes.get("brightness") is not None:
-                            bri = st.attributes.get("brightness")
-                            try:
-                                pct = int(round(bri * 100 / 255))
-                                resp["brightness"] = pct
-                            except Exception:  # noqa: BLE001
-                                pass
-                        if domain == "light":
-                            rgb = st.attributes.get("rgb_color")
-                            hs = st.attributes.get("hs_color")
-                            ct = st.attributes.get("color_temp")
-                            cur = {}
-                            if rgb and isinstance(rgb,(list,tuple)) and len(rgb)==3:
-                                try:
-                                    r,g,b = rgb
-                                    spec = (int(r)<<16) + (int(g)<<8) + int(b)
-                                    cur["spectrumRgb"] = spec
-                                except Exception:  # noqa: BLE001
-                                    pass
-                            elif hs and isinstance(hs,(list,tuple)) and len(hs)==2:
-                                pass
-                            if ct and isinstance(ct,(int,float)) and ct>0:
-                                try:
-                                    k = int(round(1000000/ct))
-                                    cur["temperatureK"] = k
-                                except Exception:  # noqa: BLE001
-                                    pass
-                            if cur:
-                                resp["currentColor"] = cur
-                        devices[sid] = resp
-                    elif domain == "climate":
-                        cur = st.attributes.get("current_temperature")
-                        hvac = st.state
-                        fan_mode = st.attributes.get("fan_mode")
-                        mode_map = {
-                            "off": "off",
-                            "heat": "heat",
-                            "cool": "cool",
-                            "heat_cool": "heatcool",
-                            "auto": "heatcool",
-                            "fan_only": "fan-only",
-                            "dry": "dry",
-                        }
-                        g_mode = mode_map.get(hvac, "off")
-                        resp = {"online": True, "thermostatMode": g_mode}
-                        if cur is not None:
-                            resp["thermostatTemperatureAmbient"] = cur
-                        target = st.attributes.get("temperature")
-                        if target is not None:
-                            resp["thermostatTemperatureSetpoint"] = target
-                        low = st.attributes.get("target_temp_low")
-                        high = st.attributes.get("target_temp_high")
-                        if low is not None and high is not None:
-                            resp["thermostatTemperatureSetpointLow"] = low
-                            resp["thermostatTemperatureSetpointHigh"] = high
-                        if fan_mode:
-                            resp["currentFanSpeedSetting"] = f"speed_{fan_mode.lower()}"
-                        resp["on"] = g_mode != "off"
-                        devices[sid] = resp
-                    elif domain == "sensor":
-                        dclass = st.attributes.get("device_class")
-                        if dclass == "temperature":
-                            try:
-                                val = float(st.state)
-                            except Exception:  # noqa: BLE001
-                                continue
-                            devices[sid] = {"online": True, "thermostatMode": "off", "thermostatTemperatureAmbient": val}
-                        elif dclass == "humidity":
-                            try:
-                                val = float(st.state)
-                            except Exception:  # noqa: BLE001
-                                continue
-                            devices[sid] = {"online": True, "humidityAmbientPercent": val}
+                # Serializers zijn per device gekozen bij SYNC; onveranderde states komen uit de memo
+                with span("query.states") as sa:
+                    devices = self.device_mgr.query_states(requested_ids)
+                    sa["devices"] = len(devices)
                 build_end = _t.perf_counter()
-                filtered = len(target_pairs)
-                logger.debug("habridge: QUERY devices=%d requested=%d selected=%d", len(devices), len(requested_ids) or filtered, len(selected_eids))
+                logger.debug("habridge: QUERY devices=%d requested=%d selected=%d", len(devices), len(requested_ids) or len(devices), selected_count)
                 parse_ms = int((q_parse_start - t_start)*1000)
                 build_ms = int((build_end - build_start)*1000)
                 total_ms = int(( _t.perf_counter() - t_start)*1000)
-                self._push_log("QUERY", f"devices={len(devices)} req={len(requested_ids) or 0} sel={len(selected_eids)} parseMs={parse_ms} buildMs={build_ms} timeMs={total_ms}", request_id)
+                trace = current_trace()
+                if trace is not None:
+                    trace.shape = {"requested": len(requested_ids), "devices": len(devices), "selected": selected_count}
+                self._push_log("QUERY", f"devices={len(devices)} req={len(requested_ids) or 0} sel={selected_count} parseMs={parse_ms} buildMs={build_ms} timeMs={total_ms}", request_id)
                 try:
                     self.device_mgr.record_latency('query', total_ms)
                 except Exception:  # noqa: BLE001
                     pass
-                return web.json_response({"requestId": request_id, "payload": {"devices": devices}})
+                return self._respond({"requestId": request_id, "payload": {"devices": devices}})
             if intent == "action.devices.EXECUTE":
                 raw_group = inputs[0].get("payload", {}) if isinstance(inputs[0], dict) else {}
                 commands = raw_group.get("commands", []) if isinstance(raw_group, dict) else []
                 if not isinstance(commands, list):
                     logger.warning("habridge: EXECUTE malformed commands structure: %s", commands)
                     self._push_log("ERROR", "EXECUTE malformed commands struct")
-                    return web.json_response({"requestId": request_id, "payload": {"errorCode": "protocolError"}}, status=400)
-                results = await self.device_mgr.execute(commands)
+                    return json_response({"requestId": request_id, "payload": {"errorCode": "protocolError"}}, status=400)
+                # Google retries EXECUTE with the same requestId when we are slow: run it only once
+                with span("execute") as sa:
+                    results, replay = await self._replay.run(self._agent_key(request), request_id, lambda: self.device_mgr.execute(commands))
+                    sa["replay"] = replay
+                trace = current_trace()
+                if trace is not None:
+                    trace.shape = {
+                        "groups": len(commands),
+                        "devices": sum(len(g.get("devices") or []) for g in commands if isinstance(g, dict)),
+                        "commands": sorted({str(ex.get("command", "?")).split('.')[-1] for g in commands if isinstance(g, dict) for ex in (g.get("execution") or []) if isinstance(ex, dict)}),
+                        "pending": sum(1 for r in results if r.get("status") == "PENDING"),
+                        "errors": sum(1 for r in results if r.get("status") == "ERROR"),
+                        "replay": replay,
+                    }
+                if replay:
+                    dt = int(( _t.perf_counter() - t_start)*1000)
+                    logger.info("habridge: EXECUTE retry %s served from %s result", request_id, replay)
+                    self._push_log("EXECUTE", f"replay={replay} results={len(results)} timeMs={dt}", request_id)
+                    return self._respond({"requestId": request_id, "payload": {"commands": results}})
                 # Build detailed log: list every execution with entity + command
                 detail_parts = []
                 try:
@@ -295,19 +369,20 @@ class SmartHomeView(HomeAssistantView):
                 short_detail = ';'.join(detail_parts)[:600]
                 logger.info("habridge: EXECUTE processed %d groups %s", len(commands), short_detail)
                 dt = int(( _t.perf_counter() - t_start)*1000)
-                self._push_log("EXECUTE", f"groups={len(commands)} results={len(results)} timeMs={dt} {short_detail}", request_id)
+                pending = sum(1 for r in results if r.get("status") == "PENDING")
+                self._push_log("EXECUTE", f"groups={len(commands)} results={len(results)} pending={pending} timeMs={dt} {short_detail}", request_id)
                 try:
                     self.device_mgr.record_latency('exec', dt)
                 except Exception:  # noqa: BLE001
                     pass
-                return web.json_response({"requestId": request_id, "payload": {"commands": [{"ids": r["ids"], "status": r["status"]} for r in results]}})
+                return self._respond({"requestId": request_id, "payload": {"commands": results}})
             logger.warning("habridge: unknown intent '%s'", intent)
             self._push_log("UNKNOWN", intent or '', request_id)
-            return web.json_response({"requestId": request_id, "payload": {}}, status=200)
+            return json_response({"requestId": request_id, "payload": {}}, status=200)
         except Exception as exc:  # noqa: BLE001
             logger.exception("habridge: exception processing intent %s", intent)
             self._push_log("ERROR", str(exc), request_id)
-            return web.json_response({"requestId": request_id, "payload": {"errorCode": "internalError"}}, status=500)
+            return json_response({"requestId": request_id, "payload": {"errorCode": "internalError"}}, status=500)
 
 class HealthView(HomeAssistantView):
     url = HEALTH_PATH
@@ -315,7 +390,7 @@ class HealthView(HomeAssistantView):
     requires_auth = False
 
     async def get(self, request):
-        return web.json_response({"status": "ok", "ha_version": HA_VERSION})
+        return json_response({"status": "ok", "ha_version": HA_VERSION})
 
 # ---- Admin / Devices ----
 
@@ -361,6 +436,7 @@ button:hover{background:#f0f3f5;}
         <a href="#" class="active" onclick="showView('devices');return false;">Devices</a>
         <a href="#" onclick="showView('logs');return false;">Logs</a>
         <a href="#" onclick="showView('metrics');return false;">Metrics</a>
+        <a href="#" onclick="showView('slow');return false;">Slow</a>
         <a href="#" onclick="showView('settings');return false;">Settings</a>
     </nav>
     <span id="counts" class="pill"></span>
@@ -382,10 +458,24 @@ button:hover{background:#f0f3f5;}
     <div id="view-logs" style="display:none;">
         <div class='toolbar'>
             <button onclick='refreshLogs()'>Refresh Logs</button>
+            <button onclick='downloadTraces()' title='Chrome trace / Perfetto (ui.perfetto.dev)'>Download Traces</button>
+            <button onclick='downloadProfile()' title='Sample de event loop 10s; collapsed stacks voor flamegraph.pl / speedscope'>Profile 10s</button>
             <button onclick='clearLogs()'>Clear</button>
         </div>
     <table id='logtbl'><thead><tr><th style='width:40px;'>#</th><th style='width:95px;'>Date</th><th style='width:80px;'>Time</th><th style='width:90px;'>ReqID</th><th style='width:90px;'>Intent</th><th>Detail</th></tr></thead><tbody></tbody></table>
     </div>
+    <div id="view-slow" style="display:none;">
+        <div class='toolbar'>
+            <button onclick='loadSlow()'>Refresh</button>
+            <button onclick='clearSlow()'>Clear</button>
+            <label style='font-size:12px;'>SYNC <input id='slow_sync' type='number' min='50' max='30000' step='50' style='width:80px;'></label>
+            <label style='font-size:12px;'>QUERY <input id='slow_query' type='number' min='50' max='30000' step='50' style='width:80px;'></label>
+            <label style='font-size:12px;'>EXECUTE <input id='slow_execute' type='number' min='50' max='30000' step='50' style='width:80px;'></label>
+            <button onclick='saveSlow()'>Drempels opslaan (ms)</button>
+            <span id='slow_status' class='muted'></span>
+        </div>
+    <table id='slowtbl'><thead><tr><th style='width:80px;'>Time</th><th style='width:90px;'>ReqID</th><th style='width:70px;'>Intent</th><th style='width:70px;'>ms</th><th>Shape</th><th>Phases (ms)</th><th>Service calls (ms)</th><th style='width:110px;'>Loop lag</th></tr></thead><tbody></tbody></table>
+    </div>
     <div id="view-metrics" style="display:none;max-width:960px;">
         <h3>Metrics</h3>
         <div style='display:flex;flex-wrap:wrap;gap:16px;'>
@@ -396,7 +486,18 @@ button:hover{background:#f0f3f5;}
                     <tbody id='latRows'></tbody>
                 </table>
                 <div id='loopLag' class='muted' style='margin-top:6px;font-size:11px;'></div>
+                <h4 style='margin:12px 0 8px 0;font-size:14px;'>Latency per venster (ms)</h4>
+                <table style='width:100%;border-collapse:collapse;font-size:12px;'>
+                    <thead><tr><th style='text-align:left;'>Kind</th><th>Venster</th><th>Count</th><th>p50</th><th>p90</th><th>p99</th><th>Max</th></tr></thead>
+                    <tbody id='latWinRows'></tbody>
+                </table>
                 <div id='cacheAge' class='muted' style='margin-top:4px;font-size:11px;'></div>
+                <div id='memoryInfo' class='muted' style='margin-top:2px;font-size:11px;'></div>
+                <h4 style='margin:12px 0 8px 0;font-size:14px;'>Admission</h4>
+                <table style='width:100%;border-collapse:collapse;font-size:12px;'>
+                    <thead><tr><th style='text-align:left;'>Class</th><th>In flight</th><th>Queued</th><th>Rejected</th><th>Shed</th><th>Queue avg</th><th>Queue max</th></tr></thead>
+                    <tbody id='admRows'></tbody>
+                </table>
             </div>
             <div style='flex:2;min-width:320px;background:#fff;border:1px solid #d9dee3;border-radius:6px;padding:12px;max-height:320px;overflow:auto;'>
                 <h4 style='margin:0 0 8px 0;font-size:14px;'>Per-Device EXECUTE Timing (ms)</h4>
@@ -405,6 +506,21 @@ button:hover{background:#f0f3f5;}
                     <tbody id='execDevRows'></tbody>
                 </table>
             </div>
+            <div style='flex:1;min-width:320px;background:#fff;border:1px solid #d9dee3;border-radius:6px;padding:12px;max-height:320px;overflow:auto;'>
+                <h4 style='margin:0 0 8px 0;font-size:14px;'>EXECUTE Concurrency per Integratie</h4>
+                <table style='width:100%;border-collapse:collapse;font-size:12px;'>
+                    <thead><tr><th style='text-align:left;'>Integratie</th><th>Limit</th><th>In flight</th><th>Queued</th><th>Calls</th><th>Decreases</th><th>Avg</th></tr></thead>
+                    <tbody id='limiterRows'></tbody>
+                </table>
+            </div>
+            <div style='flex:1 1 100%;background:#fff;border:1px solid #d9dee3;border-radius:6px;padding:12px;max-height:360px;overflow:auto;'>
+                <h4 style='margin:0 0 8px 0;font-size:14px;'>Blokkerende Call Sites (event loop)</h4>
+                <div id='blockingInfo' class='muted' style='font-size:11px;margin-bottom:6px;'></div>
+                <table style='width:100%;border-collapse:collapse;font-size:12px;'>
+                    <thead><tr><th style='text-align:left;'>Site</th><th>Stalls</th><th>Geblokkeerd (ms)</th><th>Max (ms)</th><th style='text-align:left;'>Stack</th></tr></thead>
+                    <tbody id='blockingRows'></tbody>
+                </table>
+            </div>
         </div>
         <div class='muted' style='margin-top:12px;font-size:12px;'>Automatisch verversen elke 5s terwijl dit tabblad zichtbaar is.</div>
     </div>
@@ -439,6 +555,31 @@ button:hover{background:#f0f3f5;}
             <button onclick='toggleRoomHint()'>Opslaan</button>
             <span id='roomhint_status' class='muted' style='margin-left:10px;'></span>
         </div>
+        <div style='background:#fff;border:1px solid #d9dee3;border-radius:6px;padding:14px;margin-bottom:16px;'>
+            <h4 style='margin-top:0;'>EXECUTE Latency Budget</h4>
+            <label style='font-size:13px;'>Budget (ms)<br><input id='exec_budget' type='number' min='250' max='9000' step='250' style='width:120px;padding:6px;'></label>
+            <label style='display:flex;align-items:center;gap:8px;font-size:14px;margin:8px 0;'><input type='checkbox' id='exec_budget_adaptive'/> Adaptief per device (p95 × 2, max budget)</label>
+            <p class='muted'>Devices die niet binnen het budget klaar zijn worden als PENDING aan Google gemeld; de service call loopt op de achtergrond door.</p>
+            <button onclick='saveExecBudget()'>Opslaan</button>
+            <span id='exec_budget_status' class='muted' style='margin-left:10px;'></span>
+        </div>
+        <div style='background:#fff;border:1px solid #d9dee3;border-radius:6px;padding:14px;margin-bottom:16px;'>
+            <h4 style='margin-top:0;'>Blocking Watchdog (diagnose)</h4>
+            <label style='display:flex;align-items:center;gap:8px;font-size:14px;margin-bottom:8px;'><input type='checkbox' id='blocking_watchdog'/> Leg de stack vast als de event loop blokkeert</label>
+            <label style='font-size:13px;margin-right:12px;'>Drempel (ms)<br><input id='blocking_threshold' type='number' min='20' max='2000' step='10' style='width:100px;padding:6px;'></label>
+            <label style='font-size:13px;'>Interval (ms)<br><input id='blocking_interval' type='number' min='5' max='1000' step='5' style='width:100px;padding:6px;'></label>
+            <p class='muted'>Een watchdog thread controleert elke interval een heartbeat op de event loop. Kleiner interval = nauwkeuriger, iets meer overhead. Resultaten in de Metrics tab.</p>
+            <button onclick='saveBlocking()'>Opslaan</button>
+            <span id='blocking_status' class='muted' style='margin-left:10px;'></span>
+        </div>
+        <div style='background:#fff;border:1px solid #d9dee3;border-radius:6px;padding:14px;margin-bottom:16px;'>
+            <h4 style='margin-top:0;'>Geheugen Budget</h4>
+            <label style='font-size:13px;'>Budget (MB, 0 = uit)<br><input id='memory_budget' type='number' min='0' max='512' step='4' style='width:100px;padding:6px;'></label>
+            <p class='muted'>Boven het budget worden eerst oude logs, traces en slow log entries opgeruimd, daarna timings van niet-geselecteerde devices en de SYNC cache. Device selecties, aliassen en tokens blijven altijd staan.</p>
+            <label style='display:flex;align-items:center;gap:8px;font-size:14px;margin:8px 0;'><input type='checkbox' id='sync_streaming'/> Stream SYNC antwoorden in chunks (grote installaties)</label>
+            <button onclick='saveMemoryBudget()'>Opslaan</button>
+            <span id='memory_budget_status' class='muted' style='margin-left:10px;'></span>
+        </div>
         <div style='background:#fff;border:1px solid #d9dee3;border-radius:6px;padding:14px;'>
             <h4 style='margin-top:0;'>Device List Filters</h4>
             <p class='muted'>Beheer welke domeinen zichtbaar zijn in het Devices overzicht. Wordt lokaal opgeslagen (browser).</p>
@@ -464,13 +605,14 @@ document.getElementById('domainFilter').addEventListener('change',filter);
 document.getElementById('onlySel').addEventListener('change',filter);
 const areaFilterEl = document.getElementById('areaFilter'); if(areaFilterEl) areaFilterEl.addEventListener('change',filter);
 function showView(v){
-    ['devices','logs','metrics','settings'].forEach(x=>{ const el=document.getElementById('view-'+x); if(el) el.style.display=x===v?'block':'none'; });
+    ['devices','logs','metrics','slow','settings'].forEach(x=>{ const el=document.getElementById('view-'+x); if(el) el.style.display=x===v?'block':'none'; });
     document.querySelectorAll('nav a').forEach(a=>a.classList.remove('active'));
-    const order=['devices','logs','metrics','settings'];
+    const order=['devices','logs','metrics','slow','settings'];
     const idx=order.indexOf(v); if(idx>=0) document.querySelectorAll('nav a')[idx].classList.add('active');
     if(v==='logs'){refreshLogs(); startLogTimer(); stopDevTimer(); stopMetricsTimer();}
     else if(v==='devices'){refreshDevicesValue(); if(_backgroundUpdates) startDevTimer(); stopLogTimer(); stopMetricsTimer();}
     else if(v==='metrics'){ loadMetrics(); startMetricsTimer(); stopLogTimer(); stopDevTimer(); }
+    else if(v==='slow'){ loadSlow(); stopLogTimer(); stopDevTimer(); stopMetricsTimer(); }
     else {stopLogTimer(); stopDevTimer(); stopMetricsTimer();}
 }
 async function loadSettings(){
@@ -480,8 +622,39 @@ async function loadSettings(){
         const s=data.settings||{}; const cb=document.getElementById('roomhint_toggle'); if(cb) cb.checked=!!s.roomhint_enabled;
         const cid=document.getElementById('cid'); if(cid && s.client_id) cid.value=s.client_id;
         const csec=document.getElementById('csec'); if(csec && s.client_secret) csec.value=s.client_secret;
+        const eb=document.getElementById('exec_budget'); if(eb) eb.value=s.exec_budget_ms||4000;
+        const ea=document.getElementById('exec_budget_adaptive'); if(ea) ea.checked=s.exec_budget_adaptive!==false;
+        const bw=document.getElementById('blocking_watchdog'); if(bw) bw.checked=!!s.blocking_watchdog;
+        const bt=document.getElementById('blocking_threshold'); if(bt) bt.value=s.blocking_threshold_ms||100;
+        const bi=document.getElementById('blocking_interval'); if(bi) bi.value=s.blocking_interval_ms||20;
+        const mb=document.getElementById('memory_budget'); if(mb) mb.value=s.memory_budget_mb||0;
+        const ss=document.getElementById('sync_streaming'); if(ss) ss.checked=!!s.sync_streaming;
     }catch(e){}
 }
+async function saveBlocking(){
+    const st=document.getElementById('blocking_status'); st.textContent='Bezig...';
+    const body={blocking_watchdog:document.getElementById('blocking_watchdog').checked,blocking_threshold_ms:parseInt(document.getElementById('blocking_threshold').value||'100',10),blocking_interval_ms:parseInt(document.getElementById('blocking_interval').value||'20',10)};
+    try {
+        const r=await fetch('/habridge/settings?token='+encodeURIComponent(ADMIN_TOKEN),{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(body)});
+        if(r.ok){ st.textContent='Opgeslagen'; setTimeout(()=>{st.textContent='';},2000);} else { st.textContent='Fout'; }
+    } catch(e){ st.textContent='Fout'; }
+}
+async function saveMemoryBudget(){
+    const st=document.getElementById('memory_budget_status'); st.textContent='Bezig...';
+    const body={memory_budget_mb:parseInt(document.getElementById('memory_budget').value||'0',10),sync_streaming:document.getElementById('sync_streaming').checked};
+    try {
+        const r=await fetch('/habridge/settings?token='+encodeURIComponent(ADMIN_TOKEN),{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(body)});
+        if(r.ok){ st.textContent='Opgeslagen'; setTimeout(()=>{st.textContent='';},2000);} else { st.textContent='Fout'; }
+    } catch(e){ st.textContent='Fout'; }
+}
+async function saveExecBudget(){
+    const st=document.getElementById('exec_budget_status'); st.textContent='Bezig...';
+    const body={exec_budget_ms:parseInt(document.getElementById('exec_budget').value||'4000',10),exec_budget_adaptive:document.getElementById('exec_budget_adaptive').checked};
+    try {
+        const r=await fetch('/habridge/settings?token='+encodeURIComponent(ADMIN_TOKEN),{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(body)});
+        if(r.ok){ st.textContent='Opgeslagen'; setTimeout(()=>{st.textContent='';},2000);} else { st.textContent='Fout'; }
+    } catch(e){ st.textContent='Fout'; }
+}
 async function toggleRoomHint(){
     const cb=document.getElementById('roomhint_toggle'); if(!cb) return; const val=cb.checked; const st=document.getElementById('roomhint_status');
     st.textContent='Bezig...';
@@ -627,6 +800,33 @@ function renderLogs(){
         tb.appendChild(tr);
     });
 }
+const _ESC={'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'};
+function _esc(v){ return String(v==null?'':v).replace(/[&<>"']/g,c=>_ESC[c]); }
+async function loadSlow(){
+    try{
+        const r=await fetch('/habridge/slow?token='+encodeURIComponent(ADMIN_TOKEN)); if(!r.ok) return; const data=await r.json();
+        const th=data.thresholds||{}; ['sync','query','execute'].forEach(k=>{ const el=document.getElementById('slow_'+k); if(el && document.activeElement!==el) el.value=th[k]; });
+        const st=data.stats||{}; document.getElementById('slow_status').textContent=`${st.entries||0} entries, ${Math.round((st.bytes||0)/1024)} KB`;
+        const tb=document.querySelector('#slowtbl tbody'); tb.innerHTML='';
+        (data.entries||[]).slice().reverse().forEach(e=>{
+            const shape=Object.entries(e.shape||{}).map(([k,v])=>`${k}=${Array.isArray(v)?v.join(','):v}`).join(' ');
+            const phases=Object.entries(e.phases||{}).filter(([k])=>!k.startsWith('call ')).map(([k,v])=>`${k}=${v}`).join(' ');
+            const calls=(e.calls||[]).map(c=>`${c.call}[${c.entities}]=${c.ms}${c.ok?'':' '+c.errorCode}`).join('<br>');
+            const lag=e.loopLagMs||{};
+            const tr=document.createElement('tr');
+            tr.innerHTML=`<td>${new Date(e.ts).toLocaleTimeString()}</td><td>${_esc(e.rid)}</td><td>${_esc(e.intent)}</td><td>${e.timeMs}</td><td><code style='font-size:11px;'>${_esc(shape)}</code></td><td><code style='font-size:11px;'>${_esc(phases)}</code></td><td><code style='font-size:11px;'>${calls.split('<br>').map(_esc).join('<br>')}</code></td><td>last=${lag.last??'-'} p99=${lag.p99_1m??'-'}</td>`;
+            tb.appendChild(tr);
+        });
+    }catch(e){}
+}
+async function clearSlow(){ await fetch('/habridge/slow?token='+encodeURIComponent(ADMIN_TOKEN),{method:'DELETE'}); loadSlow(); }
+async function saveSlow(){
+    const st=document.getElementById('slow_status'); const slow={};
+    ['sync','query','execute'].forEach(k=>{ const v=parseInt(document.getElementById('slow_'+k).value,10); if(!isNaN(v)) slow[k]=v; });
+    try{ const r=await fetch('/habridge/settings?token='+encodeURIComponent(ADMIN_TOKEN),{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({slow_ms:slow})}); st.textContent=r.ok?'Opgeslagen':'Fout'; }catch(e){ st.textContent='Fout'; }
+}
+function downloadTraces(){ window.location='/habridge/traces?token='+encodeURIComponent(ADMIN_TOKEN); }
+function downloadProfile(){ window.location='/habridge/profile?seconds=10&token='+encodeURIComponent(ADMIN_TOKEN); }
 async function clearLogs(){ await fetch('/habridge/logs?token='+encodeURIComponent(ADMIN_TOKEN),{method:'DELETE'}); _logs=[]; renderLogs(); }
 function startLogTimer(){ if(_logTimer) return; _logTimer=setInterval(refreshLogs,5000); }
 function stopLogTimer(){ if(_logTimer){clearInterval(_logTimer); _logTimer=null;} }
@@ -712,9 +912,15 @@ async function loadMetrics(){
         const r=await fetch('/habridge/status?token='+encodeURIComponent(ADMIN_TOKEN));
         if(!r.ok) return; const data=await r.json();
         const lat=data.latency||{}; const tb=document.getElementById('latRows'); if(tb){ tb.innerHTML=''; ['sync','query','execute'].forEach(k=>{ const st=lat[k]||{}; const tr=document.createElement('tr'); tr.innerHTML=`<td>${k}</td><td>${st.count||0}</td><td>${st.p50||'-'}</td><td>${st.p95||'-'}</td><td>${st.max||'-'}</td>`; tb.appendChild(tr); }); }
+        const winTb=document.getElementById('latWinRows'); if(winTb){ winTb.innerHTML=''; ['sync','query','execute','loopLagMs'].forEach(k=>{ const ws=(lat[k]||{}).windows||{}; ['1m','15m','24h'].forEach(w=>{ const st=ws[w]; if(!st||!st.count) return; const tr=document.createElement('tr'); tr.innerHTML=`<td>${k}</td><td>${w}</td><td>${st.count}</td><td>${st.p50}</td><td>${st.p90}</td><td>${st.p99}</td><td>${st.max}</td>`; winTb.appendChild(tr); }); }); }
         const lag=lat.loopLagMs||{}; const lagEl=document.getElementById('loopLag'); if(lagEl){ lagEl.textContent=`Loop lag p95=${lag.p95||'-'}ms max=${lag.max||'-'}ms (n=${lag.count||0})`; }
         const cacheEl=document.getElementById('cacheAge'); if(cacheEl){ cacheEl.textContent=`SYNC cache age: ${data.cacheAgeMs!=null?data.cacheAgeMs+'ms':'(none)'}`; }
+        const mem=data.memory||{}; const memEl=document.getElementById('memoryInfo'); if(memEl && mem.usedBytes!=null){ const ev=Object.entries(mem.evictions||{}).map(([k,v])=>k+'='+v).join(', '); memEl.textContent=`Geheugen: ${Math.round(mem.usedBytes/1024)} KB van ${mem.budgetBytes?Math.round(mem.budgetBytes/1048576)+' MB':'(geen budget)'}${ev?' · opgeruimd: '+ev:''}`; }
         const execStats=data.execDeviceStats||{}; const devTb=document.getElementById('execDevRows'); if(devTb){ devTb.innerHTML=''; const entries=Object.entries(execStats).sort((a,b)=> (b[1].p95||0)-(a[1].p95||0)); entries.slice(0,80).forEach(([sid,st])=>{ const tr=document.createElement('tr'); tr.innerHTML=`<td>${sid}</td><td>${st.count||0}</td><td>${st.last||'-'}</td><td>${st.p50||'-'}</td><td>${st.p95||'-'}</td><td>${st.max||'-'}</td>`; devTb.appendChild(tr); }); }
+        const adm=data.admission||{}; const admTb=document.getElementById('admRows'); if(admTb){ admTb.innerHTML=''; ['execute','sync','query'].forEach(k=>{ const st=adm[k]; if(!st) return; const tr=document.createElement('tr'); tr.innerHTML=`<td>${k}</td><td>${st.inFlight}</td><td>${st.queued}</td><td>${st.rejected}</td><td>${st.shed}</td><td>${st.queueMsAvg}</td><td>${st.queueMsMax}</td>`; admTb.appendChild(tr); }); }
+        const blk=data.blocking||{}; const blkInfo=document.getElementById('blockingInfo'); if(blkInfo){ blkInfo.textContent=blk.enabled?`Actief: drempel ${blk.thresholdMs}ms, interval ${blk.intervalMs}ms, ${blk.stalls} stalls, check ${blk.checkUsAvg}µs`:'Uit (Settings → Blocking Watchdog)'; }
+        const blkTb=document.getElementById('blockingRows'); if(blkTb){ blkTb.innerHTML=''; (blk.top||[]).forEach(a=>{ const tr=document.createElement('tr'); tr.innerHTML=`<td><code style='font-size:11px;'>${_esc(a.site)}</code></td><td>${a.stalls}</td><td>${a.blockedMs}</td><td>${a.maxMs}</td><td><code style='font-size:10px;'>${(a.stack||[]).map(_esc).join('<br>')}</code></td>`; blkTb.appendChild(tr); }); }
+        const lims=data.execLimiters||{}; const limTb=document.getElementById('limiterRows'); if(limTb){ limTb.innerHTML=''; Object.entries(lims).sort((a,b)=>(b[1].calls||0)-(a[1].calls||0)).forEach(([k,st])=>{ const tr=document.createElement('tr'); tr.innerHTML=`<td>${k}</td><td>${st.limit}</td><td>${st.inFlight}</td><td>${st.queued}</td><td>${st.calls}</td><td>${st.decreases}</td><td>${st.avgMs!=null?st.avgMs:'-'}</td>`; limTb.appendChild(tr); }); }
     }catch(e){}
 }
 
@@ -792,7 +998,7 @@ class DevicesView(HomeAssistantView):
     async def get(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         data = self.hass.data.get('habridge') or {}
         aliases = data.get('aliases')
         if aliases is None:
@@ -870,19 +1076,19 @@ class DevicesView(HomeAssistantView):
         resp = {"devices": out}
         if debug:
             resp["area_sources"] = area_sources
-        return web.json_response(resp)
+        return json_response(resp)
 
     async def post(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         data = await request.json()
         updates = data.get("updates", {})
         await self.device_mgr.bulk_update(updates)
         if getattr(self, '_smart', None):
             changed = ",".join([f"{k}={v}" for k,v in updates.items()][:10])
             self._smart._push_log("SELECT", f"updates={len(updates)} sample={changed}")
-        return web.json_response({"status": "ok"})
+        return json_response({"status": "ok"})
 
 class LogsView(HomeAssistantView):
     url = "/habridge/logs"
@@ -896,15 +1102,103 @@ class LogsView(HomeAssistantView):
     async def get(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
-        return web.json_response({"logs": self._smart._log_buf})
+            return json_response({"error": "unauthorized"}, status=401)
+        return json_response({"logs": self._smart._log_buf})
 
     async def delete(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         self._smart._log_buf.clear()
-        return web.json_response({"status": "cleared"})
+        return json_response({"status": "cleared"})
+
+class TracesView(HomeAssistantView):
+    """Last smarthome request traces as Chrome trace / Perfetto JSON."""
+    url = "/habridge/traces"
+    name = "habridge:traces"
+    requires_auth = False
+
+    def __init__(self, smart_view: SmartHomeView, admin_token: str):
+        self._smart = smart_view
+        self._token = admin_token
+
+    async def get(self, request):
+        supplied = request.query.get('token')
+        if supplied != self._token:
+            return json_response({"error": "unauthorized"}, status=401)
+        # optional filter on Google requestId or trace id
+        data = self._smart._tracer.chrome_trace(request.query.get('request_id'))
+        return json_response(data, headers={"Content-Disposition": "attachment; filename=habridge-trace.json"})
+
+class SlowLogView(HomeAssistantView):
+    url = "/habridge/slow"
+    name = "habridge:slow"
+    requires_auth = False
+
+    def __init__(self, smart_view: SmartHomeView, admin_token: str):
+        self._smart = smart_view
+        self._token = admin_token
+
+    async def get(self, request):
+        supplied = request.query.get('token')
+        if supplied != self._token:
+            return json_response({"error": "unauthorized"}, status=401)
+        return json_response({
+            "thresholds": self._smart.slow_thresholds(),
+            "stats": self._smart._slow.stats(),
+            "entries": self._smart._slow.entries(),
+        })
+
+    async def delete(self, request):
+        supplied = request.query.get('token')
+        if supplied != self._token:
+            return json_response({"error": "unauthorized"}, status=401)
+        self._smart._slow.clear()
+        return json_response({"status": "cleared"})
+
+class ProfileView(HomeAssistantView):
+    """Sample the event loop thread for N seconds; collapsed stacks for flamegraph tools."""
+    url = "/habridge/profile"
+    name = "habridge:profile"
+    requires_auth = False
+
+    def __init__(self, hass: HomeAssistant, admin_token: str):
+        self.hass = hass
+        self._token = admin_token
+        self._sampler = StackSampler()
+
+    async def get(self, request):
+        supplied = request.query.get('token')
+        if supplied != self._token:
+            return json_response({"error": "unauthorized"}, status=401)
+        try:
+            seconds = float(request.query.get('seconds', 10))
+            interval_ms = float(request.query.get('interval_ms', 10))
+        except ValueError:
+            return json_response({"error": "invalid_params"}, status=400)
+        if not 1 <= seconds <= 60 or not 1 <= interval_ms <= 1000:
+            return json_response({"error": "invalid_params"}, status=400)
+        habridge_only = request.query.get('habridge_only', '0').lower() in ('1', 'true', 'yes')
+        # one profile at a time (checked and set on the loop thread)
+        if self._sampler.running:
+            return json_response({"error": "profile_running"}, status=409)
+        self._sampler.running = True
+        try:
+            counts = await self.hass.async_add_executor_job(
+                self._sampler.sample, threading.get_ident(), seconds, interval_ms, habridge_only
+            )
+        finally:
+            self._sampler.running = False
+        info = self._sampler.last or {}
+        logging.getLogger(__name__).info("habridge: profile %.0fs samples=%s idle=%s stacks=%s", seconds, info.get('samples'), info.get('idle'), info.get('stacks'))
+        return web.Response(
+            text=StackSampler.collapsed(counts),
+            content_type="text/plain",
+            headers={
+                "Content-Disposition": "attachment; filename=habridge-profile.folded",
+                "X-Habridge-Profile": json.dumps(info, separators=(',', ':')),
+            },
+        )
 
 class SyncPreviewView(HomeAssistantView):
     url = "/habridge/sync_preview"
@@ -918,9 +1212,11 @@ class SyncPreviewView(HomeAssistantView):
     async def get(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
-        devices = self._dm.build_sync()
-        return web.json_response({"devices": devices})
+            return json_response({"error": "unauthorized"}, status=401)
+        devices = await self._dm.async_build_sync()
+        devices_json, digest = self._dm.encoded_sync(devices)
+        return web.Response(body=b'{"devices":' + devices_json + b'}', content_type="application/json",
+                            headers={"X-Habridge-Sync-Hash": digest})
 
 class SettingsView(HomeAssistantView):
     url = "/habridge/settings"
@@ -935,19 +1231,19 @@ class SettingsView(HomeAssistantView):
     async def get(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         data = self.hass.data.get('habridge') or {}
         settings = data.get('settings') or {}
-        return web.json_response({"settings": settings})
+        return json_response({"settings": settings})
 
     async def post(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         try:
             body = await request.json()
         except Exception:  # noqa: BLE001
-            return web.json_response({"error": "invalid_json"}, status=400)
+            return json_response({"error": "invalid_json"}, status=400)
         data = self.hass.data.get('habridge') or {}
         settings = data.get('settings') or {}
         changed = False
@@ -956,6 +1252,79 @@ class SettingsView(HomeAssistantView):
             if settings.get('roomhint_enabled') != val:
                 settings['roomhint_enabled'] = val
                 changed = True
+        if 'exec_budget_ms' in body:
+            try:
+                budget = int(body['exec_budget_ms'])
+            except (TypeError, ValueError):
+                return json_response({"error": "invalid_exec_budget_ms"}, status=400)
+            budget = max(250, min(budget, 9000))
+            if settings.get('exec_budget_ms') != budget:
+                settings['exec_budget_ms'] = budget
+                changed = True
+        if 'exec_budget_adaptive' in body:
+            val = bool(body['exec_budget_adaptive'])
+            if settings.get('exec_budget_adaptive') != val:
+                settings['exec_budget_adaptive'] = val
+                changed = True
+        blocking_changed = False
+        if 'blocking_watchdog' in body:
+            val = bool(body['blocking_watchdog'])
+            if settings.get('blocking_watchdog') != val:
+                settings['blocking_watchdog'] = val
+                blocking_changed = True
+        blocking_vals = {}
+        for key, lo, hi in (('blocking_threshold_ms', 20, 2000), ('blocking_interval_ms', 5, 1000)):
+            if key in body:
+                try:
+                    blocking_vals[key] = max(lo, min(int(body[key]), hi))
+                except (TypeError, ValueError):
+                    return json_response({"error": f"invalid_{key}"}, status=400)
+        if blocking_vals:
+            # Lateness below a few intervals is scheduling jitter, not a stall
+            threshold = blocking_vals.get('blocking_threshold_ms', settings.get('blocking_threshold_ms') or 100)
+            interval = blocking_vals.get('blocking_interval_ms', settings.get('blocking_interval_ms') or 20)
+            if threshold < interval * MIN_THRESHOLD_FACTOR:
+                return json_response({"error": "invalid_blocking_threshold_ms", "minThresholdMs": interval * MIN_THRESHOLD_FACTOR}, status=400)
+        for key, val in blocking_vals.items():
+            if settings.get(key) != val:
+                settings[key] = val
+                blocking_changed = True
+            changed = True
+            wd = data.get('watchdog')
+            if wd is not None:
+                wd.configure(bool(settings.get('blocking_watchdog')), settings.get('blocking_threshold_ms'), settings.get('blocking_interval_ms'))
+        if 'sync_streaming' in body:
+            val = bool(body['sync_streaming'])
+            if settings.get('sync_streaming') != val:
+                settings['sync_streaming'] = val
+                changed = True
+        if 'memory_budget_mb' in body:
+            try:
+                val = int(body['memory_budget_mb'])
+            except (TypeError, ValueError):
+                return json_response({"error": "invalid_memory_budget_mb"}, status=400)
+            # 0 = measure only; otherwise 4..512 MB
+            val = 0 if val <= 0 else max(4, min(val, 512))
+            if (settings.get('memory_budget_mb') or 0) != val:
+                settings['memory_budget_mb'] = val
+                changed = True
+                if data.get('memory') is not None:
+                    data['memory'].configure(val)
+        if 'slow_ms' in body:
+            raw = body['slow_ms']
+            if not isinstance(raw, dict):
+                return json_response({"error": "invalid_slow_ms"}, status=400)
+            slow = dict(settings.get('slow_ms') or {})
+            for klass, val in raw.items():
+                if klass not in DEFAULT_SLOW_MS:
+                    continue
+                try:
+                    slow[klass] = max(50, min(int(val), 30000))
+                except (TypeError, ValueError):
+                    return json_response({"error": "invalid_slow_ms"}, status=400)
+            if settings.get('slow_ms') != slow:
+                settings['slow_ms'] = slow
+                changed = True
         if 'client_id' in body and isinstance(body.get('client_id'), str):
             new_id = body['client_id'].strip()
             if new_id and settings.get('client_id') != new_id:
@@ -976,8 +1345,8 @@ class SettingsView(HomeAssistantView):
         if changed:
             # persist
             store = data.get('settings_store')
-            if store:
-                await store.async_save(settings)
+            if store and data.get('saves') is not None:
+                data['saves'].schedule('settings', store, lambda: settings)
             # invalidate sync cache if roomhint or credentials changed (safe to always invalidate on any setting change)
             dm = data.get('device_mgr')
             if dm:
@@ -992,6 +1361,18 @@ class SettingsView(HomeAssistantView):
             log_parts = []
             if 'roomhint_enabled' in body:
                 log_parts.append(f"roomhint_enabled={settings.get('roomhint_enabled')}")
+            if 'exec_budget_ms' in body:
+                log_parts.append(f"exec_budget_ms={settings.get('exec_budget_ms')}")
+            if 'exec_budget_adaptive' in body:
+                log_parts.append(f"exec_budget_adaptive={settings.get('exec_budget_adaptive')}")
+            if 'slow_ms' in body:
+                log_parts.append(f"slow_ms={settings.get('slow_ms')}")
+            if 'sync_streaming' in body:
+                log_parts.append(f"sync_streaming={settings.get('sync_streaming')}")
+            if 'memory_budget_mb' in body:
+                log_parts.append(f"memory_budget_mb={settings.get('memory_budget_mb') or 0}")
+            if blocking_changed:
+                log_parts.append(f"blocking_watchdog={settings.get('blocking_watchdog')} threshold={settings.get('blocking_threshold_ms')} interval={settings.get('blocking_interval_ms')}")
             if 'client_id' in body:
                 cid = settings.get('client_id') or ''
                 log_parts.append(f"client_id={cid}")
@@ -1000,7 +1381,7 @@ class SettingsView(HomeAssistantView):
                 mask = (cs[:4] + '***' + cs[-4:]) if len(cs) > 8 else '***'
                 log_parts.append(f"client_secret={mask}")
             self._smart._push_log("SET", ' '.join(log_parts))
-        return web.json_response({"settings": settings, "changed": changed})
+        return json_response({"settings": settings, "changed": changed})
 
 class TriggerSyncView(HomeAssistantView):
     url = "/habridge/trigger_sync"
@@ -1015,11 +1396,15 @@ class TriggerSyncView(HomeAssistantView):
     async def post(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
-        devices = self._dm.build_sync()
-        roomhint_count = sum(1 for d in devices if 'roomHint' in d)
+            return json_response({"error": "unauthorized"}, status=401)
+        # Force a new generation; concurrent callers attach to this build
+        devices = await self._dm.async_build_sync(force=True)
+        roomhint_count = sum(1 for d in devices if d.room_hint is not None)
         self._smart._push_log("SYNC_TRIGGER", f"devices={len(devices)} roomhints={roomhint_count}")
-        return web.json_response({"devices": devices, "count": len(devices), "roomhint_count": roomhint_count})
+        devices_json, digest = self._dm.encoded_sync(devices)
+        tail = json_dumps({"count": len(devices), "roomhint_count": roomhint_count, "hash": digest})
+        return web.Response(body=b'{"devices":' + devices_json + b',' + tail[1:], content_type="application/json",
+                            headers={"X-Habridge-Sync-Hash": digest})
 
 class AliasesView(HomeAssistantView):
     url = "/habridge/aliases"
@@ -1034,30 +1419,30 @@ class AliasesView(HomeAssistantView):
     async def get(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         data = self.hass.data.get('habridge') or {}
         aliases = data.get('aliases')
         if aliases is None:
             aliases = {}
             data['aliases'] = aliases
-        return web.json_response({"aliases": aliases})
+        return json_response({"aliases": aliases})
 
     async def post(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         try:
             body = await request.json()
         except Exception:  # noqa: BLE001
-            return web.json_response({"error": "invalid_json"}, status=400)
+            return json_response({"error": "invalid_json"}, status=400)
         sid = body.get('id')  # stable id or entity id
         new_name = body.get('alias')
         if not sid:
-            return web.json_response({"error": "missing_id"}, status=400)
+            return json_response({"error": "missing_id"}, status=400)
         if new_name is None:
-            return web.json_response({"error": "missing_alias"}, status=400)
+            return json_response({"error": "missing_alias"}, status=400)
         if not isinstance(new_name, str):
-            return web.json_response({"error": "alias_not_string"}, status=400)
+            return json_response({"error": "alias_not_string"}, status=400)
         data = self.hass.data.get('habridge') or {}
         aliases = data.get('aliases')
         if aliases is None:
@@ -1078,8 +1463,8 @@ class AliasesView(HomeAssistantView):
             # preserve exact whitespace user entered
             aliases[sid_key] = new_name
         store = data.get('alias_store')
-        if store:
-            await store.async_save(aliases)
+        if store and data.get('saves') is not None:
+            data['saves'].schedule('aliases', store, lambda: aliases)
         if dm:
             try:
                 if hasattr(dm, 'debounce_invalidate'):
@@ -1090,7 +1475,7 @@ class AliasesView(HomeAssistantView):
                 pass
         log_val = '(cleared)' if removed else new_name
         self._smart._push_log("ALIAS", f"{sid_key}={log_val}")
-        return web.json_response({"id": sid_key, "alias": '' if removed else new_name})
+        return json_response({"id": sid_key, "alias": '' if removed else new_name})
 
 class StatusView(HomeAssistantView):
     url = "/habridge/status"
@@ -1105,10 +1490,11 @@ class StatusView(HomeAssistantView):
     async def get(self, request):
         supplied = request.query.get('token')
         if supplied != self._token:
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
         data = self.hass.data.get('habridge') or {}
         aliases = data.get('aliases') or {}
         settings = data.get('settings') or {}
+        smart = data.get('smart_view')
         # Build area map quickly (non blocking: rely on existing state & registries if available)
         area_lookup = {}
         try:
@@ -1126,13 +1512,12 @@ class StatusView(HomeAssistantView):
                     area_lookup[ent.entity_id] = ar.areas[area_id].name
         except Exception:  # noqa: BLE001
             pass
-        sync_devices = self._dm.build_sync()
+        sync_devices = await self._dm.async_build_sync()
         total = len(sync_devices)
-        with_roomhint = sum(1 for d in sync_devices if 'roomHint' in d)
+        with_roomhint = sum(1 for d in sync_devices if d.room_hint is not None)
         with_alias = 0
         for d in sync_devices:
-            names = d.get('name') or {}
-            if names.get('name') and d.get('id') in aliases:
+            if d.name and d.id in aliases:
                 with_alias += 1
         # area coverage (by entity list)
         all_entities = list(self._dm.list_entities())
@@ -1143,7 +1528,7 @@ class StatusView(HomeAssistantView):
                 stats = self._dm.latency_stats() or {}
         except Exception:  # noqa: BLE001
             stats = {}
-        return web.json_response({
+        return json_response({
             "devices": total,
             "withAlias": with_alias,
             "withArea": with_area,
@@ -1152,4 +1537,68 @@ class StatusView(HomeAssistantView):
             "cacheAgeMs": self._dm.sync_cache_age_ms(),
             "latency": stats,
             "execDeviceStats": getattr(self._dm, 'exec_device_stats', lambda: {})(),
+            "execLimiters": self._dm.limiter_stats(),
+            "execReplay": smart._replay.stats() if smart else {},
+            "admission": smart._admission.stats() if smart else {},
+            "syncBuild": self._dm.sync_build_stats(),
+            "warmStart": self._dm.warm_start_stats(),
+            "blocking": data['watchdog'].stats() if data.get('watchdog') else {},
+            "memory": data['memory'].stats() if data.get('memory') else {},
+            "persistence": data['saves'].stats() if data.get('saves') else {},
+            "jsonBackend": JSON_BACKEND,
         })
+
+class MetricsView(HomeAssistantView):
+    """OpenMetrics exposition for Prometheus; renders existing counters only.
+
+    HA auth (long-lived access token as Bearer) instead of the admin token:
+    the admin token changes on every restart, a scrape config cannot follow.
+    """
+    url = "/habridge/metrics"
+    name = "habridge:metrics"
+    requires_auth = True
+
+    def __init__(self, hass: HomeAssistant, device_mgr: DeviceManager):
+        self.hass = hass
+        self._dm = device_mgr
+
+    async def get(self, request):
+        data = self.hass.data.get('habridge') or {}
+        body = exposition.render(
+            self._dm,
+            token_mgr=data.get('token_mgr'),
+            smart_view=data.get('smart_view'),
+            saves=data.get('saves'),
+        )
+        return web.Response(body=body.encode('utf-8'), headers={"Content-Type": exposition.CONTENT_TYPE})
+
+class MemoryView(HomeAssistantView):
+    """Entry counts and approximate deep sizes of bridge caches, growth since startup."""
+    url = "/habridge/memory"
+    name = "habridge:memory"
+    requires_auth = False
+
+    def __init__(self, hass: HomeAssistant, admin_token: str):
+        self.hass = hass
+        self._token = admin_token
+
+    async def get(self, request):
+        supplied = request.query.get('token')
+        if supplied != self._token:
+            return json_response({"error": "unauthorized"}, status=401)
+        data = self.hass.data.get('habridge') or {}
+        acct = data.get('memory')
+        out = acct.report() if acct else {}
+        if data.get('token_mgr'):
+            out["tokens"] = data['token_mgr'].token_ages()
+        # tracemalloc=start|stop toggles tracing (costly, diagnose only); tracemalloc=1 adds the top-N
+        tm = request.query.get('tracemalloc')
+        if tm in ('start', 'stop'):
+            set_tracemalloc(tm == 'start')
+        if tm:
+            try:
+                limit = max(1, min(100, int(request.query.get('top', 20))))
+            except ValueError:
+                limit = 20
+            out["tracemalloc"] = tracemalloc_top(limit)
+        return json_response(out)
@@ -0,0 +1,51 @@
+from __future__ import annotations
+from datetime import date, datetime, time
+import json
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from aiohttp import web
+
+# orjson ships with Home Assistant core; the stdlib encoder is the fallback
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+CONTENT_TYPE = "application/json"
+
+
+def _default(obj):
+    # tuples/lists/dicts are native; sets as list, datetimes (state attributes) as ISO text
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _OPTS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj) -> bytes:
+        """Compact JSON as UTF-8 bytes."""
+        return orjson.dumps(obj, default=_default, option=_OPTS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumps(obj) -> bytes:
+        """Compact JSON as UTF-8 bytes."""
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+    def loads(data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode("utf-8")
+        return json.loads(data)
+
+
+def json_response(data, status: int = 200, headers: dict | None = None) -> web.Response:
+    """Drop-in for ``web.json_response`` that encodes straight to bytes."""
+    from aiohttp import web  # only needed by the views; keeps dumps/loads importable standalone
+    return web.Response(body=dumps(data), status=status, content_type=CONTENT_TYPE, headers=headers)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+from collections import deque
+import asyncio
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for service calls towards one integration.
+
+    Every call that finishes within ``tolerance`` of the running latency average
+    raises the limit by ``1/limit`` (so +1 per full window). A failed or slow
+    call halves it, at most once per average latency, so one burst does not
+    collapse the limit to the minimum. Batched calls (N entities in one call)
+    take longer by nature: they count for success/failure but neither feed
+    the latency average nor trigger the slow check.
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 32, tolerance: float = 2.0, floor_ms: float = 250.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.floor_ms = floor_ms
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._ewma_ms: float | None = None
+        self._last_decrease = 0.0
+        self.calls = 0
+        self.decreases = 0
+        self.queued_total = 0
+
+    def _cap(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        if not self._waiters and self.in_flight < self._cap():
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self.queued_total += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # slot was granted just before cancellation
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self._cap():
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+    def observe(self, ms: float, ok: bool = True, batched: bool = False):
+        """Feed the duration of a finished call into the AIMD controller."""
+        loop_time = asyncio.get_running_loop().time()
+        self.calls += 1
+        avg = self._ewma_ms
+        slow = not batched and avg is not None and ms > max(self.floor_ms, avg * self.tolerance)
+        if not ok or slow:
+            if loop_time - self._last_decrease >= (avg or ms) / 1000.0:
+                self.limit = max(float(self.min_limit), self.limit / 2)
+                self._last_decrease = loop_time
+                self.decreases += 1
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+            self._wake()
+        if not batched:
+            self._ewma_ms = ms if avg is None else avg * 0.9 + ms * 0.1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self._cap(),
+            "inFlight": self.in_flight,
+            "queued": len(self._waiters),
+            "queuedTotal": self.queued_total,
+            "calls": self.calls,
+            "decreases": self.decreases,
+            "avgMs": int(self._ewma_ms) if self._ewma_ms is not None else None,
+        }
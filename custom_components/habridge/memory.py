@@ -0,0 +1,285 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import types
+from array import array
+from collections import deque
+
+LOGGER = logging.getLogger(__name__)
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Never walk into these: shared interpreter objects or graphs (tasks -> loop -> hass)
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+           types.CoroutineType, types.FrameType, asyncio.Future, asyncio.Handle)
+_ATOMIC = (str, bytes, bytearray, int, float, bool, type(None), array)
+
+
+def deep_sizeof(obj, max_objects: int = 200_000) -> tuple[int, bool]:
+    """Approximate deep size in bytes of ``obj``; returns ``(bytes, truncated)``.
+
+    Iterative walk over containers and plain objects (``__dict__`` / ``__slots__``);
+    shared objects are counted once. Interned strings and small ints are counted
+    as if owned, so the result is an upper bound of what eviction would free.
+    """
+    seen: set = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        oid = id(o)
+        if oid in seen or isinstance(o, _OPAQUE):
+            continue
+        seen.add(oid)
+        if len(seen) > max_objects:
+            return total, True
+        total += sys.getsizeof(o, 0)
+        if isinstance(o, _ATOMIC):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        else:
+            d = getattr(o, "__dict__", None)
+            if d is not None:
+                stack.append(d)
+            for cls in type(o).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    if hasattr(o, name):
+                        stack.append(getattr(o, name))
+    return total, False
+
+
+def _count(obj):
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+def process_rss() -> int | None:
+    """Resident set size in bytes (Linux ``/proc``), None elsewhere."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryAccounting:
+    """Entry counts and deep sizes of the bridge's long-lived structures.
+
+    Owners register a name with a getter returning the structure (resolved at
+    report time, so replaced objects are followed). ``take_baseline`` records
+    the sizes at startup; ``report`` adds the growth since then. Sizing walks
+    every object on the event loop, so it is on demand only.
+    """
+
+    def __init__(self):
+        self._structures: dict = {}  # name -> getter
+        self._baseline: dict = {}  # name -> (count, bytes)
+        self._baseline_ts: float | None = None
+        self._baseline_rss: int | None = None
+
+    def register(self, name: str, getter):
+        self._structures[name] = getter
+
+    def _measure(self, name: str) -> dict:
+        try:
+            obj = self._structures[name]()
+        except Exception as exc:  # noqa: BLE001
+            return {"error": str(exc)}
+        size, truncated = deep_sizeof(obj)
+        out = {"count": _count(obj), "bytes": size}
+        if truncated:
+            out["truncated"] = True
+        return out
+
+    def take_baseline(self):
+        self._baseline = {}
+        for name in self._structures:
+            m = self._measure(name)
+            self._baseline[name] = (m.get("count"), m.get("bytes", 0))
+        self._baseline_ts = time.time()
+        self._baseline_rss = process_rss()
+
+    def report(self) -> dict:
+        structures = {}
+        total = 0
+        for name in self._structures:
+            m = self._measure(name)
+            base = self._baseline.get(name)
+            if base is not None and "bytes" in m:
+                m["growthBytes"] = m["bytes"] - base[1]
+                if m.get("count") is not None and base[0] is not None:
+                    m["growthCount"] = m["count"] - base[0]
+            total += m.get("bytes", 0)
+            structures[name] = m
+        rss = process_rss()
+        return {
+            "totalBytes": total,
+            "structures": structures,
+            "process": {
+                "rssBytes": rss,
+                "rssGrowthBytes": rss - self._baseline_rss if rss is not None and self._baseline_rss is not None else None,
+            },
+            "baselineAgeS": int(time.time() - self._baseline_ts) if self._baseline_ts else None,
+        }
+
+
+def trim_oldest(seq, fraction: float) -> int:
+    """Drop the oldest ``fraction`` of a list or deque (at least one entry)."""
+    n = min(len(seq), max(1, int(len(seq) * fraction + 0.999))) if seq else 0
+    if isinstance(seq, deque):
+        for _ in range(n):
+            seq.popleft()
+    else:
+        del seq[:n]
+    return n
+
+
+class MemoryGovernor(MemoryAccounting):
+    """Memory budget over the evictable structures.
+
+    Structures that can shrink register an ``evict(fraction) -> dropped``
+    callback and a priority (lower = less valuable, evicted first). Only
+    these are sized, every ``interval`` seconds and only while a budget is
+    configured (sizing walks objects on the event loop). Above the budget the
+    governor asks them, cheapest data first, to drop the share needed to get
+    back to ``low_water`` of the budget. Structures without an evictor
+    (idmap, selections, aliases, refresh tokens) are reported by
+    ``MemoryAccounting.report`` only.
+    """
+
+    def __init__(self, budget_bytes: int = 0, interval: float = 300.0, low_water: float = 0.9):
+        super().__init__()
+        self.budget_bytes = budget_bytes
+        self.interval = interval
+        self.low_water = low_water
+        self._policies: dict = {}  # name -> (priority, evict)
+        self._handle = None
+        self._hass = None
+        self.used_bytes: int | None = None
+        self.last_check: float | None = None
+        self.checks = 0
+        self.over_budget = 0
+        self.evictions: dict = {}  # name -> entries dropped
+        self._check_s = 0.0
+
+    def register(self, name: str, getter, evict=None, priority: int = 100):
+        super().register(name, getter)
+        if evict is not None:
+            self._policies[name] = (priority, evict)
+
+    def configure(self, budget_mb):
+        """``budget_mb`` 0/None disables the governor (no periodic sizing at all)."""
+        self.budget_bytes = int(budget_mb or 0) * 1024 * 1024
+        if not self.budget_bytes:
+            self.stop()
+        elif self._hass is not None and self._handle is None:
+            self._handle = self._hass.loop.call_later(self.interval, self._on_timer)
+
+    def start(self, hass):
+        self._hass = hass
+        if self.budget_bytes and self._handle is None:
+            self._handle = hass.loop.call_later(self.interval, self._on_timer)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _on_timer(self):
+        self._handle = None
+        try:
+            self.enforce()
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.warning("habridge: memory governor failed: %s", exc)
+        if self._hass is not None and self.budget_bytes:
+            self._handle = self._hass.loop.call_later(self.interval, self._on_timer)
+
+    def enforce(self) -> int:
+        """Size the evictable structures and evict when over budget; returns bytes (estimated) freed."""
+        t0 = time.perf_counter()
+        sizes = {}
+        for name in self._policies:
+            m = self._measure(name)
+            sizes[name] = m.get("bytes", 0)
+        used = sum(sizes.values())
+        freed = 0
+        if self.budget_bytes and used > self.budget_bytes:
+            self.over_budget += 1
+            need = used - int(self.budget_bytes * self.low_water)
+            for priority, name, evict in sorted((p, n, e) for n, (p, e) in self._policies.items()):
+                size = sizes.get(name, 0)
+                if need <= 0:
+                    break
+                if not size:
+                    continue
+                fraction = min(1.0, need / size)
+                try:
+                    dropped = evict(fraction) or 0
+                except Exception as exc:  # noqa: BLE001
+                    LOGGER.warning("habridge: evicting %s failed: %s", name, exc)
+                    continue
+                if dropped:
+                    self.evictions[name] = self.evictions.get(name, 0) + dropped
+                    need -= int(size * fraction)
+                    freed += int(size * fraction)
+            LOGGER.info("habridge: memory %d KB over budget %d KB, freed ~%d KB", used // 1024, self.budget_bytes // 1024, freed // 1024)
+        self.used_bytes = used - freed
+        self.last_check = time.time()
+        self.checks += 1
+        self._check_s += time.perf_counter() - t0
+        return freed
+
+    def stats(self) -> dict:
+        return {
+            "budgetBytes": self.budget_bytes,
+            "usedBytes": self.used_bytes,
+            "lastCheckAgeS": int(time.time() - self.last_check) if self.last_check else None,
+            "intervalSec": self.interval,
+            "checks": self.checks,
+            "checkMsAvg": round(self._check_s / self.checks * 1000, 1) if self.checks else 0,
+            "overBudget": self.over_budget,
+            "evictions": dict(self.evictions),
+            "evictable": [n for _p, n in sorted((p, n) for n, (p, _e) in self._policies.items())],
+        }
+
+
+def set_tracemalloc(enabled: bool):
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def tracemalloc_top(limit: int = 20) -> dict:
+    """Top allocation sites in habridge modules (tracemalloc must be tracing)."""
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(True, os.path.join(_PACKAGE_DIR, "*")),)
+    )
+    stats = snapshot.statistics("lineno")
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing": True,
+        "tracedBytes": current,
+        "peakBytes": peak,
+        "habridgeBytes": sum(s.size for s in stats),
+        "top": [
+            {
+                "site": f"{os.path.relpath(s.traceback[0].filename, _PACKAGE_DIR)}:{s.traceback[0].lineno}",
+                "bytes": s.size,
+                "blocks": s.count,
+            }
+            for s in stats[:limit]
+        ],
+    }
@@ -0,0 +1,256 @@
+from __future__ import annotations
+from array import array
+import time
+
+# Resolution 0.1ms; 2**SUB_BITS buckets per power of two (~3% relative error at the midpoint)
+UNIT = 10
+SUB_BITS = 4
+SUB = 1 << SUB_BITS
+MAX_UNITS = (1 << 20) - 1  # ~105s; larger values land in the last bucket (max stays exact)
+
+
+def bucket_index(units: int) -> int:
+    if units < SUB:
+        return units
+    shift = units.bit_length() - SUB_BITS - 1
+    return shift * SUB + (units >> shift)
+
+
+def bucket_value(idx: int) -> float:
+    """Midpoint of a bucket in ms."""
+    if idx < SUB:
+        return idx / UNIT
+    shift = idx // SUB - 1
+    low = (idx - shift * SUB) << shift
+    return (low + ((1 << shift) - 1) / 2) / UNIT
+
+
+NBUCKETS = bucket_index(MAX_UNITS) + 1
+
+# Cumulative (since start) bucket bounds in ms for /habridge/metrics
+EXPORT_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _export_slot(ms: float) -> int:
+    for i, bound in enumerate(EXPORT_BOUNDS_MS):
+        if ms <= bound:
+            return i
+    return len(EXPORT_BOUNDS_MS)
+
+
+class LatencyWindows:
+    """Log-linear (HDR-style) latency histograms over rolling time windows.
+
+    Every window is a ring of per-slot histograms (1m = 6 x 10s, 15m = 15 x 1m,
+    24h = 24 x 1h); recording bumps one counter per window, a slot is cleared
+    when the ring wraps onto it. Memory is fixed: slots are allocated on first
+    use and never grow. Percentiles merge the live slots of a window.
+    """
+
+    WINDOWS = (("1m", 10, 6), ("15m", 60, 15), ("24h", 3600, 24))
+
+    def __init__(self):
+        self._rings = {}
+        for name, slot_s, slots in self.WINDOWS:
+            # per slot: [slot_id, counts, count, max]
+            self._rings[name] = (slot_s, slots, [None] * slots)
+        # since start, for exposition (non-cumulative per export bucket, last = +Inf)
+        self.total = array('Q', bytes(8 * (len(EXPORT_BOUNDS_MS) + 1)))
+        self.total_count = 0
+        self.total_sum = 0.0
+
+    def record(self, ms: float, now: float | None = None):
+        if now is None:
+            now = time.monotonic()
+        if ms < 0:
+            ms = 0.0
+        idx = bucket_index(min(int(ms * UNIT), MAX_UNITS))
+        self.total[_export_slot(ms)] += 1
+        self.total_count += 1
+        self.total_sum += ms
+        for slot_s, slots, ring in self._rings.values():
+            slot_id = int(now // slot_s)
+            pos = slot_id % slots
+            slot = ring[pos]
+            if slot is None:
+                slot = ring[pos] = [slot_id, array('I', bytes(4 * NBUCKETS)), 0, 0.0]
+            elif slot[0] != slot_id:
+                slot[0] = slot_id
+                slot[1] = array('I', bytes(4 * NBUCKETS))
+                slot[2] = 0
+                slot[3] = 0.0
+            slot[1][idx] += 1
+            slot[2] += 1
+            if ms > slot[3]:
+                slot[3] = ms
+
+    def window(self, name: str, now: float | None = None) -> dict:
+        if now is None:
+            now = time.monotonic()
+        slot_s, slots, ring = self._rings[name]
+        current = int(now // slot_s)
+        live = [s for s in ring if s is not None and current - s[0] < slots and s[2]]
+        count = sum(s[2] for s in live)
+        if not count:
+            return {"count": 0}
+        merged = [0] * NBUCKETS
+        for s in live:
+            for i, c in enumerate(s[1]):
+                if c:
+                    merged[i] += c
+        peak = max(s[3] for s in live)
+        out = {"count": count}
+        targets = (("p50", 0.50), ("p90", 0.90), ("p95", 0.95), ("p99", 0.99))
+        seen = 0
+        t = 0
+        for i, c in enumerate(merged):
+            if not c:
+                continue
+            seen += c
+            while t < len(targets) and seen >= targets[t][1] * count:
+                # never report a percentile above the exact max
+                out[targets[t][0]] = _round(min(bucket_value(i), peak))
+                t += 1
+            if t == len(targets):
+                break
+        out["max"] = _round(peak)
+        return out
+
+    def stats(self, now: float | None = None) -> dict:
+        if now is None:
+            now = time.monotonic()
+        return {name: self.window(name, now) for name, _s, _n in self.WINDOWS}
+
+
+def _round(ms: float):
+    return int(round(ms)) if ms >= 10 else round(ms, 1)
+
+
+class DeviceTimings:
+    """Per-device EXECUTE durations in preallocated ``array`` ring buffers.
+
+    Each stable id gets a dense row number; all rows live in one flat float
+    array (``window`` samples per row). Rows of evicted devices go to a free
+    list and are reused, so memory is bounded by the number of devices that
+    were executed while selected. Stats are cached per row and only the rows
+    written since the last call are recomputed, in one pass.
+    """
+
+    GROW = 64  # rows allocated at a time
+
+    def __init__(self, window: int = 20):
+        self.window = window
+        self._rows: dict = {}  # sid -> row
+        self._sids: list = []  # row -> sid | None
+        self._free: list = []
+        self._data = array('f')
+        self._count = array('H')
+        self._pos = array('H')
+        self._last = array('f')
+        self._dirty: set = set()
+        self._cache: dict = {}  # row -> stats dict
+        # since start (per row): export bucket counts, count and sum, for exposition
+        self._nb = len(EXPORT_BOUNDS_MS) + 1
+        self._hist = array('I')
+        self._total = array('I')
+        self._sum = array('d')
+
+    def _row_for(self, sid: str) -> int:
+        row = self._rows.get(sid)
+        if row is not None:
+            return row
+        if not self._free:
+            base = len(self._sids)
+            self._sids.extend([None] * self.GROW)
+            self._data.extend(array('f', [0.0]) * (self.GROW * self.window))
+            self._count.extend(array('H', [0]) * self.GROW)
+            self._pos.extend(array('H', [0]) * self.GROW)
+            self._last.extend(array('f', [0.0]) * self.GROW)
+            self._hist.extend(array('I', [0]) * (self.GROW * self._nb))
+            self._total.extend(array('I', [0]) * self.GROW)
+            self._sum.extend(array('d', [0.0]) * self.GROW)
+            self._free.extend(range(base + self.GROW - 1, base - 1, -1))
+        row = self._free.pop()
+        self._rows[sid] = row
+        self._sids[row] = sid
+        self._count[row] = 0
+        self._pos[row] = 0
+        self._total[row] = 0
+        self._sum[row] = 0.0
+        base = row * self._nb
+        for i in range(base, base + self._nb):
+            self._hist[i] = 0
+        return row
+
+    def record(self, sid: str, ms: float):
+        row = self._row_for(sid)
+        pos = self._pos[row]
+        self._data[row * self.window + pos] = ms
+        self._pos[row] = (pos + 1) % self.window
+        if self._count[row] < self.window:
+            self._count[row] += 1
+        self._last[row] = ms
+        self._hist[row * self._nb + _export_slot(ms)] += 1
+        self._total[row] += 1
+        self._sum[row] += ms
+        self._dirty.add(row)
+
+    def evict(self, sid: str):
+        row = self._rows.pop(sid, None)
+        if row is None:
+            return
+        self._sids[row] = None
+        self._cache.pop(row, None)
+        self._dirty.discard(row)
+        self._free.append(row)
+
+    def retain(self, sids) -> int:
+        """Evict every device not in ``sids`` (e.g. no longer selected)."""
+        gone = [s for s in self._rows if s not in sids]
+        for sid in gone:
+            self.evict(sid)
+        return len(gone)
+
+    def _refresh(self):
+        if not self._dirty:
+            return
+        w = self.window
+        data = self._data
+        for row in self._dirty:
+            n = self._count[row]
+            s = sorted(data[row * w: row * w + n])
+            self._cache[row] = {
+                "count": n,
+                "last": _round(self._last[row]),
+                "p50": _round(s[_rank(50, n)]),
+                "p95": _round(s[_rank(95, n)]),
+                "max": _round(s[-1]),
+            }
+        self._dirty.clear()
+
+    def get(self, sid: str) -> dict | None:
+        row = self._rows.get(sid)
+        if row is None:
+            return None
+        self._refresh()
+        return self._cache.get(row)
+
+    def stats(self) -> dict:
+        self._refresh()
+        sids = self._sids
+        return {sids[row]: st for row, st in self._cache.items()}
+
+    def histograms(self):
+        """Yield ``(sid, bucket_counts, count, sum_ms)`` since the device was first seen."""
+        nb = self._nb
+        for sid, row in self._rows.items():
+            yield sid, self._hist[row * nb:(row + 1) * nb], self._total[row], self._sum[row]
+
+    def memory_bytes(self) -> int:
+        return sum(a.buffer_info()[1] * a.itemsize for a in (self._data, self._count, self._pos, self._last, self._hist, self._total, self._sum))
+
+
+def _rank(p: int, n: int) -> int:
+    # nearest-rank percentile index
+    idx = -(-p * n // 100) - 1
+    return max(0, min(idx, n - 1))
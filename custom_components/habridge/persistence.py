@@ -0,0 +1,44 @@
+from __future__ import annotations
+import time
+
+from .const import STORE_SAVE_DELAY
+
+
+class DelayedSaves:
+    """Counted ``Store.async_delay_save`` for the ``habridge_*`` stores.
+
+    ``schedule`` counts every requested save; the data function handed to the
+    Store counts the writes Home Assistant actually performs (after the delay
+    or at final write). The difference is what the delay coalesced.
+    """
+
+    def __init__(self, delay: float = STORE_SAVE_DELAY):
+        self.delay = delay
+        self._scheduled: dict = {}  # name -> saves requested
+        self._written: dict = {}  # name -> writes performed
+        self.last_write: float | None = None
+
+    def schedule(self, name: str, store, data_func):
+        self._scheduled[name] = self._scheduled.get(name, 0) + 1
+
+        def data():
+            self._written[name] = self._written.get(name, 0) + 1
+            self.last_write = time.time()
+            return data_func()
+
+        store.async_delay_save(data, self.delay)
+
+    def stats(self) -> dict:
+        scheduled = sum(self._scheduled.values())
+        written = sum(self._written.values())
+        return {
+            "delaySec": self.delay,
+            "scheduled": scheduled,
+            "written": written,
+            "coalesced": max(0, scheduled - written),
+            "stores": {
+                name: {"scheduled": n, "written": self._written.get(name, 0)}
+                for name, n in sorted(self._scheduled.items())
+            },
+            "lastWriteAgeS": int(time.time() - self.last_write) if self.last_write else None,
+        }
@@ -0,0 +1,181 @@
+from __future__ import annotations
+from collections import OrderedDict
+import asyncio
+import time
+
+
+class ReplayCache:
+    """Idempotency cache for EXECUTE keyed by (agent, requestId).
+
+    A retry that arrives while the original is still running attaches to the
+    same task; a retry after completion gets the cached payload. The work runs
+    in its own task so a dropped connection does not cancel it halfway.
+    """
+
+    def __init__(self, ttl: float = 120.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, task)
+        self.hits_inflight = 0
+        self.hits_cached = 0
+        self.misses = 0
+
+    def _evict(self, now: float):
+        while self._entries:
+            key, (expires_at, task) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            if not task.done() and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    async def run(self, agent: str, request_id: str, factory):
+        """Return ``(result, replay)`` where replay is None, 'inflight' or 'cached'."""
+        key = (agent, request_id)
+        now = time.monotonic()
+        self._evict(now)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            task = entry[1]
+            replay = "cached" if task.done() else "inflight"
+            if replay == "cached":
+                self.hits_cached += 1
+            else:
+                self.hits_inflight += 1
+            return await asyncio.shield(task), replay
+        self.misses += 1
+        task = asyncio.get_running_loop().create_task(factory())
+        self._entries[key] = (now + self.ttl, task)
+        self._entries.move_to_end(key)
+
+        def _drop_failed(t, key=key):
+            # Failures are not cached: the next retry executes again
+            if t.cancelled() or t.exception() is not None:
+                cur = self._entries.get(key)
+                if cur is not None and cur[1] is t:
+                    del self._entries[key]
+        task.add_done_callback(_drop_failed)
+        return await asyncio.shield(task), None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hitsInflight": self.hits_inflight,
+            "hitsCached": self.hits_cached,
+            "misses": self.misses,
+        }
+
+
+class AdmissionRejected(Exception):
+    """Request not admitted (queue timeout or overload shedding)."""
+
+    def __init__(self, klass: str, reason: str):
+        super().__init__(f"{klass}: {reason}")
+        self.klass = klass
+        self.reason = reason
+
+
+class AdmissionController:
+    """Bounded in-flight requests per intent class with EXECUTE priority.
+
+    Every class has its own in-flight limit and all classes share ``total``
+    slots. Freed slots go to the highest priority waiter first, and EXECUTE
+    may use ``execute_reserve`` slots beyond the total so a burst of SYNC or
+    QUERY never queues a user's command. QUERY is shed right away while
+    ``overloaded()`` reports sustained event loop lag.
+    """
+
+    PRIORITY = {"execute": 0, "sync": 1, "query": 2}
+
+    def __init__(self, overloaded=None, total: int = 16, execute_reserve: int = 4):
+        self.limits = {"execute": 32, "sync": 2, "query": 8}
+        self.queue_timeout = {"execute": None, "sync": 5.0, "query": 2.0}
+        self.total = total
+        self.execute_reserve = execute_reserve
+        self._overloaded = overloaded
+        self._in_flight = {k: 0 for k in self.limits}
+        self._waiters: list = []  # (priority, seq, klass, future), kept sorted
+        self._seq = 0
+        self._stats = {k: {"admitted": 0, "queued": 0, "rejected": 0, "shed": 0, "queueMsTotal": 0.0, "queueMsMax": 0.0} for k in self.limits}
+
+    def _total_in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def _can_admit(self, klass: str) -> bool:
+        if self._in_flight[klass] >= self.limits[klass]:
+            return False
+        total = self.total + (self.execute_reserve if klass == "execute" else 0)
+        return self._total_in_flight() < total
+
+    async def acquire(self, klass: str) -> float:
+        """Wait for a slot; return queue time in ms or raise AdmissionRejected."""
+        st = self._stats[klass]
+        if klass == "query" and self._overloaded is not None and self._overloaded():
+            st["shed"] += 1
+            raise AdmissionRejected(klass, "overloaded")
+        # Only jump the queue when no waiter of equal or higher priority could take
+        # the slot; a SYNC held back by its own class limit does not block a QUERY
+        prio = self.PRIORITY[klass]
+        if self._can_admit(klass) and not any(
+            w[0] <= prio and not w[3].done() and self._can_admit(w[2]) for w in self._waiters
+        ):
+            self._in_flight[klass] += 1
+            st["admitted"] += 1
+            return 0.0
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._seq += 1
+        entry = (prio, self._seq, klass, fut)
+        self._waiters.append(entry)
+        self._waiters.sort(key=lambda w: (w[0], w[1]))
+        st["queued"] += 1
+        t0 = loop.time()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=self.queue_timeout[klass])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if fut.done() and not fut.cancelled():
+                # slot granted at the same moment; give it back
+                self.release(klass)
+            else:
+                fut.cancel()
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+            if isinstance(exc, asyncio.TimeoutError):
+                st["rejected"] += 1
+                raise AdmissionRejected(klass, "queue_timeout") from None
+            raise
+        waited = (loop.time() - t0) * 1000.0
+        st["admitted"] += 1
+        st["queueMsTotal"] += waited
+        if waited > st["queueMsMax"]:
+            st["queueMsMax"] = waited
+        return waited
+
+    def release(self, klass: str):
+        self._in_flight[klass] -= 1
+        for entry in list(self._waiters):
+            _prio, _seq, wk, fut = entry
+            if fut.done():
+                self._waiters.remove(entry)
+                continue
+            if self._can_admit(wk):
+                self._waiters.remove(entry)
+                self._in_flight[wk] += 1
+                fut.set_result(None)
+
+    def stats(self) -> dict:
+        out = {}
+        for klass, st in self._stats.items():
+            queued = st["queued"]
+            out[klass] = {
+                "inFlight": self._in_flight[klass],
+                "waiting": sum(1 for w in self._waiters if w[2] == klass),
+                "limit": self.limits[klass],
+                "admitted": st["admitted"],
+                "queued": queued,
+                "rejected": st["rejected"],
+                "shed": st["shed"],
+                "queueMsAvg": round(st["queueMsTotal"] / queued, 1) if queued else 0,
+                "queueMsMax": round(st["queueMsMax"], 1),
+            }
+        return out
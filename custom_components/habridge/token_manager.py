@@ -4,6 +4,7 @@ from datetime import datetime, timedelta, timezone
 import secrets, string, jwt
 from typing import Any, Dict, Optional
 
+from .persistence import DelayedSaves
 from .const import ACCESS_TOKEN_TTL, REFRESH_TOKEN_TTL, JWT_ALG, CONF_CLIENT_SECRET
 
 @dataclass
@@ -14,9 +15,10 @@ class TokenData:
     expires_in: int
 
 class TokenManager:
-    def __init__(self, hass, store, client_secret: str):
+    def __init__(self, hass, store, client_secret: str, saves: DelayedSaves | None = None):
         self.hass = hass
         self.store = store
+        self._saves = saves or DelayedSaves()
         self.client_secret = client_secret or "dev-secret"
         self._data: Dict[str, Any] = {"auth_codes": {}, "refresh_tokens": {}}
 
@@ -25,8 +27,50 @@ class TokenManager:
         if stored:
             self._data = stored
 
+    def _schedule_save(self):
+        # Delayed write (flushed by the Store at final write): off the OAuth request path
+        self._saves.schedule("tokens", self.store, lambda: self._data)
+
     async def _persist(self):
-        await self.store.async_save(self._data)
+        self._schedule_save()
+
+    def token_counts(self) -> Dict[str, int]:
+        return {kind: len(self._data.get(kind) or {}) for kind in ("auth_codes", "refresh_tokens")}
+
+    def token_ages(self) -> Dict[str, Dict[str, Any]]:
+        """Count and oldest age (s) per kind; auth codes are single use, old ones were never exchanged."""
+        now = datetime.utcnow()
+        out: Dict[str, Dict[str, Any]] = {}
+        for kind in ("auth_codes", "refresh_tokens"):
+            ages = []
+            for meta in (self._data.get(kind) or {}).values():
+                try:
+                    ages.append((now - datetime.fromisoformat(meta["created"])).total_seconds())
+                except (KeyError, TypeError, ValueError):
+                    continue
+            out[kind] = {
+                "count": len(self._data.get(kind) or {}),
+                "oldestAgeS": int(max(ages)) if ages else None,
+                "olderThan1h": sum(1 for a in ages if a > 3600),
+            }
+        return out
+
+    def prune_auth_codes(self, max_age_s: int = 600) -> int:
+        """Drop auth codes older than ``max_age_s``; a code Google did not exchange by then never will be."""
+        now = datetime.utcnow()
+        codes = self._data.get("auth_codes") or {}
+        stale = []
+        for code, meta in codes.items():
+            try:
+                if (now - datetime.fromisoformat(meta["created"])).total_seconds() > max_age_s:
+                    stale.append(code)
+            except (KeyError, TypeError, ValueError):
+                stale.append(code)
+        for code in stale:
+            del codes[code]
+        if stale:
+            self._schedule_save()
+        return len(stale)
 
     def _gen_code(self, length=40) -> str:
         return "".join(secrets.choice(string.ascii_letters + string.digits) for _ in range(length))
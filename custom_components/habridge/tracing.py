@@ -0,0 +1,204 @@
+from __future__ import annotations
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+import secrets
+import time
+
+from .jsonenc import dumps
+
+_current: contextvars.ContextVar = contextvars.ContextVar("habridge_trace", default=None)
+
+
+class Trace:
+    """Spans of one smarthome request; ``lane`` separates concurrent spans."""
+
+    __slots__ = ("trace_id", "request_id", "intent", "shape", "wall0", "t0", "end", "spans", "_lanes", "max_spans", "_token")
+
+    def __init__(self, request_id: str | None = None, max_spans: int = 500):
+        self.trace_id = secrets.token_hex(8)
+        self.request_id = request_id
+        self.intent: str | None = None
+        self.shape: dict = {}  # request shape (device / command counts) for the slow log
+        self.wall0 = time.time()
+        self.t0 = time.perf_counter()
+        self.end: float | None = None
+        self.spans: list = []  # (name, start, end, lane, args)
+        self._lanes = 0
+        self.max_spans = max_spans
+        self._token = None  # contextvar token, reset by Tracer.finish
+
+    def new_lane(self) -> int:
+        self._lanes += 1
+        return self._lanes
+
+    def add(self, name: str, start: float, end: float, lane: int = 0, **args):
+        if len(self.spans) < self.max_spans:
+            self.spans.append((name, start, end, lane, args))
+
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.t0) * 1000.0
+
+    def phases(self) -> dict:
+        """Total ms per span name (lane 0 and concurrent lanes alike)."""
+        out: dict = {}
+        for name, start, end, _lane, _args in self.spans:
+            out[name] = out.get(name, 0.0) + (end - start) * 1000.0
+        return {k: round(v, 1) for k, v in out.items()}
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def detached(func, *args):
+    """Call ``func`` (typically a task factory) in an empty context.
+
+    Tasks copy the context they are created in; background work started from
+    a request (warm rebuild, debounce timer, snapshot save) must not record
+    spans into, or keep alive, that request's trace.
+    """
+    return contextvars.Context().run(func, *args)
+
+
+@contextmanager
+def span(name: str, lane: int | None = None, **args):
+    """Record a span on the current trace (no-op outside a request)."""
+    trace = _current.get()
+    if trace is None:
+        yield args
+        return
+    if lane is None:
+        lane = 0
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        trace.add(name, start, time.perf_counter(), lane, **args)
+
+
+class Tracer:
+    """Keeps the last ``max_traces`` traces and exports them as Chrome trace JSON."""
+
+    def __init__(self, max_traces: int = 50):
+        self._traces: deque = deque(maxlen=max_traces)
+
+    def start(self, request_id: str | None = None) -> Trace:
+        trace = Trace(request_id)
+        trace._token = _current.set(trace)
+        self._traces.append(trace)
+        return trace
+
+    def finish(self, trace: Trace):
+        trace.end = time.perf_counter()
+        token, trace._token = trace._token, None
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:  # finished from another context; that context ends with it
+                pass
+
+    def traces(self) -> list:
+        return list(self._traces)
+
+    def chrome_trace(self, request_id: str | None = None) -> dict:
+        """Chrome trace / Perfetto JSON: one process per request, one thread per lane."""
+        events = []
+        for pid, trace in enumerate(self._traces, start=1):
+            if request_id and trace.request_id != request_id and trace.trace_id != request_id:
+                continue
+            base = trace.wall0 * 1e6
+            events.append({"ph": "M", "name": "process_name", "pid": pid, "tid": 0,
+                           "args": {"name": f"{trace.intent or '?'} {trace.request_id or '-'} ({trace.trace_id})"}})
+            end = trace.end or time.perf_counter()
+            events.append({"ph": "X", "name": trace.intent or "request", "pid": pid, "tid": 0,
+                           "ts": base, "dur": (end - trace.t0) * 1e6,
+                           "args": {"requestId": trace.request_id, "traceId": trace.trace_id}})
+            for name, start, stop, lane, args in trace.spans:
+                events.append({"ph": "X", "name": name, "pid": pid, "tid": lane,
+                               "ts": base + (start - trace.t0) * 1e6, "dur": (stop - start) * 1e6,
+                               "args": {k: (v if isinstance(v, (int, float, str, bool)) or v is None else str(v)) for k, v in args.items()}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+# Default slow thresholds (ms) per intent; settings key ``slow_ms`` overrides
+DEFAULT_SLOW_MS = {"sync": 1500, "query": 500, "execute": 1500}
+
+
+class SlowLog:
+    """Requests slower than their intent threshold, bounded in entries and bytes.
+
+    Each entry keeps the request shape, time per phase, every service call
+    with its duration and the event loop lag at that moment.
+    """
+
+    def __init__(self, max_entries: int = 100, max_bytes: int = 256 * 1024, max_calls: int = 50):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_calls = max_calls
+        self._entries: deque = deque()  # (size, entry)
+        self._bytes = 0
+        self.captured = 0
+        self.evicted = 0
+
+    def add(self, trace: Trace, threshold_ms: float, loop_lag: dict | None = None) -> dict:
+        calls = []
+        for name, start, end, _lane, args in trace.spans:
+            if not name.startswith("call "):
+                continue
+            if len(calls) >= self.max_calls:
+                break
+            calls.append({
+                "call": name[5:],
+                "entities": args.get("entities"),
+                "ms": round((end - start) * 1000.0, 1),
+                "ok": args.get("ok", True),
+                "errorCode": args.get("errorCode"),
+            })
+        entry = {
+            "ts": int(trace.wall0 * 1000),
+            "rid": trace.request_id,
+            "traceId": trace.trace_id,
+            "intent": trace.intent,
+            "timeMs": round(trace.duration_ms(), 1),
+            "thresholdMs": threshold_ms,
+            "shape": trace.shape,
+            "phases": trace.phases(),
+            "calls": calls,
+            "loopLagMs": loop_lag or {},
+        }
+        size = len(dumps(entry))
+        self._entries.append((size, entry))
+        self._bytes += size
+        self.captured += 1
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            old_size, _old = self._entries.popleft()
+            self._bytes -= old_size
+            self.evicted += 1
+        return entry
+
+    def entries(self) -> list:
+        return [e for _s, e in self._entries]
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def trim(self, fraction: float) -> int:
+        """Drop the oldest ``fraction`` of the entries (memory governor)."""
+        n = min(len(self._entries), max(1, int(len(self._entries) * fraction + 0.999))) if self._entries else 0
+        for _ in range(n):
+            size, _old = self._entries.popleft()
+            self._bytes -= size
+        self.evicted += n
+        return n
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "maxEntries": self.max_entries,
+            "maxBytes": self.max_bytes,
+            "captured": self.captured,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,55 @@
+"""Encoding benchmark over realistic SYNC payloads.
+
+Compares the encoders the bridge can use for responses: stdlib ``json``
+as ``web.json_response`` calls it, stdlib compact (what ``jsonenc`` falls
+back to) and orjson when installed. Payloads come from the same synthetic
+device mix as ``bench_sync_descriptors.py``.
+
+Usage:
+  python scripts/bench_json.py [1000 5000 10000]
+"""
+from __future__ import annotations
+import json
+import sys
+import time
+
+from bench_sync_descriptors import _load_descriptors, build_descriptors
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+def _encoders():
+    yield "json (json_response)", lambda o: json.dumps(o).encode("utf-8")
+    yield "json compact", lambda o: json.dumps(o, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if orjson is not None:
+        yield "orjson", lambda o: orjson.dumps(o, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _best_ms(fn, arg, repeat: int = 7) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main(argv: list) -> None:
+    sizes = [int(a) for a in argv] or [1000, 5000, 10000]
+    as_dicts = _load_descriptors().as_dicts
+    print(f"{'devices':>8} {'encoder':>22} {'encode ms':>10} {'decode ms':>10} {'KB':>7}")
+    for n in sizes:
+        payload = {"requestId": "bench", "payload": {"agentUserId": "user", "devices": as_dicts(build_descriptors(n))}}
+        for name, enc in _encoders():
+            body = enc(payload)
+            dec = orjson.loads if name == "orjson" else json.loads
+            print(f"{n:>8} {name:>22} {_best_ms(enc, payload):>10.2f} {_best_ms(dec, body):>10.2f} {len(body) // 1024:>7}")
+    if orjson is None:
+        print("orjson not installed (Home Assistant ships it); only stdlib results shown")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
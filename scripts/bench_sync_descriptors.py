@@ -0,0 +1,124 @@
+"""Compare SYNC cache layouts: per-device dicts (old) vs slotted descriptors.
+
+Builds N synthetic devices with a realistic mix (lights with color, switches,
+thermostats, scenes) in a fresh subprocess per run and reports build time,
+traced allocations and resident memory growth.
+
+Usage:
+  python scripts/bench_sync_descriptors.py [1000 5000 10000]
+"""
+from __future__ import annotations
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DESCRIPTORS = os.path.join(HERE, "..", "custom_components", "habridge", "descriptors.py")
+
+
+def _load_descriptors():
+    # load the module on its own; the package __init__ needs Home Assistant
+    spec = importlib.util.spec_from_file_location("habridge_descriptors", DESCRIPTORS)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _rss() -> int:
+    try:
+        with open("/proc/self/statm", encoding="ascii") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def _spec(i: int):
+    """(domain, dtype, traits, attrs) like build_sync derives them from state."""
+    kind = i % 20
+    if kind < 12:
+        traits = ["action.devices.traits.OnOff", "action.devices.traits.Brightness"]
+        attrs = {}
+        if kind < 8:
+            traits.append("action.devices.traits.ColorSetting")
+            # a few light models -> a few distinct colour ranges
+            attrs = {"colorModel": "rgb", "temperatureMinK": 2000 + 200 * (i % 3), "temperatureMaxK": 6500}
+        return "light", "action.devices.types.LIGHT", traits, attrs
+    if kind < 17:
+        return "switch", "action.devices.types.SWITCH", ["action.devices.traits.OnOff"], {}
+    if kind < 19:
+        traits = ["action.devices.traits.TemperatureSetting", "action.devices.traits.OnOff", "action.devices.traits.FanSpeed"]
+        speeds = [{"speed_name": f"speed_{m}", "speed_values": [{"speed_synonym": [m], "lang": "en"}]} for m in ("low", "medium", "high")]
+        attrs = {"availableThermostatModes": "off,heat,cool", "thermostatTemperatureUnit": "C",
+                 "availableFanSpeeds": {"speeds": speeds, "ordered": True}, "reversible": False}
+        return "climate", "action.devices.types.AC_UNIT", traits, attrs
+    return "scene", "action.devices.types.SCENE", ["action.devices.traits.Scene"], {"sceneReversible": False}
+
+
+def build_dicts(n: int) -> list:
+    devices = []
+    for i in range(n):
+        domain, dtype, traits, attrs = _spec(i)
+        eid = f"{domain}.device_{i}"
+        dev = {
+            "id": f"{domain}_device_{i}",
+            "type": dtype,
+            "traits": traits,
+            "name": {"name": f"Device {i}"},
+            "willReportState": False,
+            "otherDeviceIds": [{"deviceId": eid}],
+        }
+        if attrs:
+            dev["attributes"] = attrs
+        devices.append(dev)
+    return devices
+
+
+def build_descriptors(n: int) -> list:
+    interner = _load_descriptors().DescriptorInterner()
+    devices = []
+    for i in range(n):
+        domain, dtype, traits, attrs = _spec(i)
+        devices.append(interner.device(f"{domain}_device_{i}", dtype, traits, f"Device {i}", f"{domain}.device_{i}", None, attrs))
+    return devices
+
+
+def run_one(variant: str, n: int) -> dict:
+    build = build_dicts if variant == "dict" else build_descriptors
+    if variant != "dict":
+        _load_descriptors()  # module import outside the measurement
+    rss0 = _rss()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    devices = build(n)
+    ms = (time.perf_counter() - t0) * 1000
+    traced, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = _rss() - rss0
+    # timing without tracemalloc overhead
+    t0 = time.perf_counter()
+    again = build(n)
+    ms = min(ms, (time.perf_counter() - t0) * 1000)
+    del again
+    return {"variant": variant, "devices": len(devices), "buildMs": round(ms, 1),
+            "tracedKB": traced // 1024, "rssKB": rss // 1024}
+
+
+def main(argv: list) -> None:
+    if argv and argv[0] == "--one":
+        print(json.dumps(run_one(argv[1], int(argv[2]))))
+        return
+    sizes = [int(a) for a in argv] or [1000, 5000, 10000]
+    print(f"{'devices':>8} {'variant':>11} {'build ms':>9} {'traced KB':>10} {'rss KB':>8}")
+    for n in sizes:
+        for variant in ("dict", "descriptor"):
+            out = subprocess.run([sys.executable, __file__, "--one", variant, str(n)], capture_output=True, text=True, check=True)
+            r = json.loads(out.stdout)
+            print(f"{r['devices']:>8} {r['variant']:>11} {r['buildMs']:>9} {r['tracedKB']:>10} {r['rssKB']:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])